@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+ScheduleEngine Benchmark Suite
+------------------------------
+Seeded synthetic stores → per-stage timings of optimize() and update_schedule(),
+throughput and peak memory, compared against a stored baseline JSON. Timings
+are compared relative to a fixed reference workload timed in the same run, so
+a baseline recorded while the machine was faster or slower still applies.
+
+Runs fully offline: the engine is pointed at a model path that does not exist,
+so it uses the demo predictor from _load_model_or_demo().
+
+    python benchmark.py                       # default scenario matrix vs baseline
+    python benchmark.py --staff 300 --days 90 --business-type electronics
+    python benchmark.py --update-baseline     # record the current numbers
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from statistics import median
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import index
+from index import ScheduleEngine, PredictionCache, WEEKDAYS
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+OFFLINE_MODEL_PATH = "__benchmark_no_model__.pkl"
+
+ROLES = ["cashier", "floor_exec", "picker", "qc", "delivery", "packer_fragile", "general"]
+SHIFT_NAMES = ["morning", "afternoon", "evening", "full_day"]
+
+DEFAULT_SCENARIOS = [
+    {"name": "small",  "staff": 20,  "days": 7,  "business_type": "grocery"},
+    {"name": "medium", "staff": 80,  "days": 30, "business_type": "electronics"},
+    {"name": "large",  "staff": 250, "days": 90, "business_type": "restaurant"},
+]
+
+# ---------------------------------
+# Synthetic store generator
+# ---------------------------------
+def generate_store(staff: int, days: int, business_type: str = "general", availability: float = 0.85,
+                   shift_density: float = 0.3, seed: int = 42, start: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Deterministic payload in the /schedule shape. availability is the share of
+    weekdays each person can work; shift_density is the share of staff that
+    already hold an owner-created shift on any given day.
+    """
+    rnd = random.Random(seed)
+    start = start or date(2025, 1, 6)  # a Monday
+    members = []
+    for i in range(staff):
+        n_off = sum(1 for _ in WEEKDAYS if rnd.random() > availability)
+        members.append({
+            "staff_id": f"S{i:04d}",
+            "name": f"Staff {i}",
+            "hourly_rate": float(rnd.choice([90, 110, 130, 150, 180, 220])),
+            "max_hours_per_week": rnd.choice([24, 32, 40, 48]),
+            "preferred_shifts": [rnd.choice(SHIFT_NAMES)],
+            "unavailable_days": rnd.sample(WEEKDAYS, n_off),
+            "unavailable_dates": [(start + timedelta(days=rnd.randrange(days))).isoformat()
+                                  for _ in range(rnd.randint(0, 2))],
+            "roles": rnd.sample(ROLES, rnd.randint(1, 2)),
+        })
+
+    feature_lookup = {}
+    schedule = []
+    for d in range(days):
+        day = start + timedelta(days=d)
+        ds = day.isoformat()
+        weekend = day.weekday() >= 5
+        feature_lookup[ds] = {
+            "store_id": 1, "store_size_sqft": 3500,
+            "day_of_week": day.weekday(), "is_weekend": int(weekend),
+            "sales": int(rnd.uniform(0.6, 1.4) * staff * 1500 * (1.3 if weekend else 1.0)),
+            "diwali_flag": int(rnd.random() < 0.02), "christmas_flag": 0,
+            "month": day.month, "year": day.year, "dayofmonth": day.day,
+            "weekofyear": day.isocalendar()[1], "city_Mumbai": 1,
+            "available_staff_count": staff, "total_staff_count": staff,
+        }
+        for m in rnd.sample(members, int(staff * shift_density)):
+            schedule.append({
+                "shift_id": f"own_{ds}_{m['staff_id']}", "staff_id": m["staff_id"], "date": ds,
+                "start_time": "09:00", "end_time": "17:00", "role": m["roles"][0],
+            })
+    return {"staff": members, "schedule": schedule, "feature_lookup": feature_lookup,
+            "business_type": business_type}
+
+# ---------------------------------
+# Stage timing
+# ---------------------------------
+def _offline_engine() -> ScheduleEngine:
+    engine = ScheduleEngine(model_path=OFFLINE_MODEL_PATH)
+    engine.model  # load the demo predictor outside the timed region
+    # A zero-size cache: every run measures the model, never a warm cache or the disk tier
+    engine.prediction_cache = PredictionCache(max_entries=0)
+    return engine
+
+def run_reference() -> Dict[str, float]:
+    """
+    A fixed mix of dict building, sorting and NumPy work, independent of the
+    engine. Timed next to every run, it tracks how fast the machine is right now.
+    """
+    rnd = random.Random(0)
+    t0 = time.perf_counter()
+    rows = [{"key": rnd.random(), "i": i} for i in range(50000)]
+    rows.sort(key=lambda r: r["key"])
+    np.sort(np.fromiter((r["key"] for r in rows), dtype=float)).cumsum()
+    return {"total": (time.perf_counter() - t0) * 1000}
+
+def run_optimize(engine: ScheduleEngine, payload: Dict[str, Any]) -> Dict[str, float]:
+    """ScheduleEngine.optimize() (greedy), in ms per stage as its StageTrace reports them."""
+    result = engine.optimize(payload["staff"], payload["schedule"], payload["feature_lookup"],
+                             payload["business_type"], timings=True)
+    timings = result["metadata"]["timings"]
+    t = {stage: st["ms"] for stage, st in timings["stages"].items()}
+    t["total"] = timings["total_ms"]
+    t["_shifts_out"] = result["summary"]["total_shifts_after"]
+    return t
+
+def run_update(engine: ScheduleEngine, payload: Dict[str, Any], incremental: bool) -> Dict[str, float]:
+    """update_schedule() for one staff_unavailable disruption in the middle of the horizon."""
+    dates = sorted(payload["feature_lookup"])
+    victim = next((s for s in payload["schedule"] if s["date"] >= dates[len(dates) // 2]), None)
+    if victim is None:
+        return {}
+    update = {"update_type": "staff_unavailable", "date": victim["date"], "staff_id": victim["staff_id"]}
+    t0 = time.perf_counter()
+    engine.update_schedule(payload["staff"], payload["schedule"], payload["feature_lookup"], update,
+                           payload["business_type"], incremental=incremental)
+    return {"total": (time.perf_counter() - t0) * 1000}
+
+def bench_scenario(scenario: Dict[str, Any], repeat: int, seed: int) -> Dict[str, Any]:
+    engine = _offline_engine()
+    payload = generate_store(scenario["staff"], scenario["days"], scenario.get("business_type", "general"),
+                             scenario.get("availability", 0.85), scenario.get("shift_density", 0.3), seed)
+    runs = {"reference": [], "optimize": [], "update_full": [], "update_incremental": []}
+    run_optimize(engine, payload)  # warm-up: imports, first-call allocations
+    for _ in range(repeat):
+        runs["reference"].append(run_reference())
+        runs["optimize"].append(run_optimize(engine, payload))
+        runs["update_full"].append(run_update(engine, payload, incremental=False))
+        runs["update_incremental"].append(run_update(engine, payload, incremental=True))
+    # Separate pass for memory: tracemalloc slows allocation-heavy stages, so keep it out of the timings
+    tracemalloc.start()
+    run_optimize(engine, payload)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    def best(samples: List[Dict[str, float]]) -> Dict[str, float]:
+        # Best-of-N per stage (as timeit does): the least disturbed by other load on the machine
+        keys = [k for k in samples[0] if not k.startswith("_")] if samples and samples[0] else []
+        return {k: round(min(s[k] for s in samples), 3) for k in keys}
+
+    def noise(samples: List[Dict[str, float]]) -> Optional[float]:
+        # How far the typical run sits above the best one: this run's own run-to-run variance
+        totals = [s["total"] for s in samples if s]
+        return round(median(totals) / min(totals) - 1, 3) if totals and min(totals) > 0 else None
+
+    opt = best(runs["optimize"])
+    shifts_out = runs["optimize"][0]["_shifts_out"]
+    return {
+        "scenario": scenario,
+        "seed": seed,
+        "repeat": repeat,
+        "optimize_ms": opt,
+        "update_full_ms": best(runs["update_full"]),
+        "update_incremental_ms": best(runs["update_incremental"]),
+        "reference_ms": best(runs["reference"]),
+        "noise": {f"{k}_ms": noise(v) for k, v in runs.items()},
+        "throughput": {
+            "optimize_per_s": round(1000 / opt["total"], 2) if opt.get("total") else None,
+            "shifts_per_s": round(shifts_out * 1000 / opt["total"], 1) if opt.get("total") else None,
+            "staff_days_per_s": round(scenario["staff"] * scenario["days"] * 1000 / opt["total"], 1)
+                                if opt.get("total") else None,
+        },
+        "peak_memory_mb": round(peak / 1e6, 2),
+        "shifts_out": shifts_out,
+    }
+
+# ---------------------------------
+# Baseline comparison
+# ---------------------------------
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Totals slower than baseline by more than tolerance (fraction) → regression
+    messages. Each total is first divided by the reference workload of its own
+    run, and the allowance grows by the larger run-to-run noise of the two runs.
+    """
+    regressions = []
+    base = {r["scenario"]["name"]: r for r in baseline.get("results", [])}
+    for r in results:
+        b = base.get(r["scenario"]["name"])
+        if not b:
+            continue
+        ref_now, ref_then = r.get("reference_ms", {}).get("total"), b.get("reference_ms", {}).get("total")
+        speed = ref_then / ref_now if ref_now and ref_then else 1.0
+        for section in ("optimize_ms", "update_full_ms", "update_incremental_ms"):
+            now, then = r[section].get("total"), b.get(section, {}).get("total")
+            if now is None or not then:
+                continue
+            ratio = now * speed / then
+            r.setdefault("vs_baseline", {})[section] = round(ratio, 3)
+            slack = max(r.get("noise", {}).get(section) or 0, b.get("noise", {}).get(section) or 0)
+            if ratio > 1 + tolerance + slack:
+                regressions.append(f"{r['scenario']['name']}.{section}: {now:.1f} ms vs baseline {then:.1f} ms, "
+                                   f"{(ratio - 1) * 100:+.0f}% after reference scaling ×{speed:.2f} "
+                                   f"(allowed {(tolerance + slack) * 100:+.0f}%)")
+        if b.get("peak_memory_mb") and r["peak_memory_mb"] > b["peak_memory_mb"] * (1 + tolerance):
+            regressions.append(f"{r['scenario']['name']}.peak_memory_mb: {r['peak_memory_mb']} vs "
+                               f"baseline {b['peak_memory_mb']}")
+    return regressions
+
+def print_report(results: List[Dict[str, Any]]):
+    for r in results:
+        sc = r["scenario"]
+        print(f"\n== {sc['name']}: {sc['staff']} staff × {sc['days']} days ({sc.get('business_type', 'general')})")
+        for stage, ms in r["optimize_ms"].items():
+            vs = r.get("vs_baseline", {}).get("optimize_ms") if stage == "total" else None
+            print(f"  optimize.{stage:<20} {ms:>10.2f} ms" + (f"   ×{vs} baseline" if vs else ""))
+        for section in ("update_full_ms", "update_incremental_ms"):
+            if r[section]:
+                vs = r.get("vs_baseline", {}).get(section)
+                print(f"  {section[:-3]:<29} {r[section]['total']:>10.2f} ms" + (f"   ×{vs} baseline" if vs else ""))
+        print(f"  {'reference':<29} {r['reference_ms']['total']:>10.2f} ms")
+        tp = r["throughput"]
+        print(f"  throughput: {tp['optimize_per_s']} optimize/s, {tp['shifts_per_s']} shifts/s; "
+              f"peak memory {r['peak_memory_mb']} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ScheduleEngine stages offline")
+    parser.add_argument("--staff", type=int, help="Staff count (single custom scenario)")
+    parser.add_argument("--days", type=int, default=30, help="Horizon length in days for --staff")
+    parser.add_argument("--business-type", default="general", help="business_type for --staff")
+    parser.add_argument("--availability", type=float, default=0.85, help="Share of weekdays staff can work")
+    parser.add_argument("--shift-density", type=float, default=0.3, help="Share of staff with an owner shift per day")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per scenario (best reported)")
+    parser.add_argument("--seed", type=int, default=42, help="Generator seed")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown, after reference scaling and on top of "
+                        "run-to-run noise, before failing (0.25 = 25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write results as the new baseline")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    index.logger.setLevel("WARNING")
+    if args.staff:
+        scenarios = [{"name": f"custom_{args.staff}x{args.days}", "staff": args.staff, "days": args.days,
+                      "business_type": args.business_type, "availability": args.availability,
+                      "shift_density": args.shift_density}]
+    else:
+        scenarios = DEFAULT_SCENARIOS
+
+    results = [bench_scenario(sc, args.repeat, args.seed) for sc in scenarios]
+
+    regressions = []
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                       "results": results}, f, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    if args.json:
+        print(json.dumps({"results": results, "regressions": regressions}, indent=2))
+    else:
+        print_report(results)
+        if args.update_baseline:
+            print(f"\nBaseline written to {args.baseline}")
+        elif regressions:
+            print("\nRegressions vs baseline:")
+            for msg in regressions:
+                print(f"  ✗ {msg}")
+        else:
+            print("\nNo regressions vs baseline.")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
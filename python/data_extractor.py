@@ -93,6 +93,7 @@ def extract_data_for_schedule(business_id: str, days_back: int = 30) -> dict:
                 "max_hours_per_week": member.get('max_hours_per_week', 40),
                 "preferred_shifts": preferred_shifts,
                 "unavailable_days": unavailable_days,
+                "unavailable_dates": unavailable_dates,
                 "roles": roles
             })
         
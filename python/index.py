@@ -10,14 +10,29 @@ Smart AI Staff Schedule Optimization Server
 ✅ NEW: Optional LLM-style post-processing hook (no external calls by default)
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import joblib
+import numpy as np
 import pandas as pd
-from dataclasses import dataclass, field
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+from dataclasses import dataclass, field, fields, replace
+from datetime import date, datetime
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Callable
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+import hashlib
+import heapq
+import json
 import logging
+import math
+import os
+import random
+import sqlite3
+import struct
+import threading
+import time
+import zipfile
 
 # ---------------------------------
 # Flask Setup
@@ -31,10 +46,50 @@ logger = logging.getLogger(__name__)
 # Toggle this to True after wiring a real LLM in llm_post_process()
 USE_LLM_POST = False
 
+# llm_suggestions when no day is under- or overstaffed
+NO_SUGGESTIONS = "Schedule aligns with business-type role mix and predicted demand."
+
+# Assignment strategies accepted by ScheduleEngine.optimize(solver=...)
+SOLVERS = ("greedy", "optimal")
+# Planning horizons accepted by ScheduleEngine.optimize(horizon=...): the whole
+# request as one hours budget, or one max_hours_per_week budget per ISO week
+# (the first week starting from carry_in_hours, {staff_id: hours already worked})
+HORIZONS = ("single", "weekly")
+# optimize() keywords that shape the result: what-if scenarios may override them
+# (ScheduleEngine.compare_scenarios) and they are part of the /schedule cache key
+OPTIMIZE_OPTIONS = ("solver", "solver_options", "time_budget_ms", "search_options",
+                    "slot_minutes", "business_hours", "horizon", "carry_in_hours")
+
+# ---------------------------------
+# Time helpers (minutes since midnight)
+# ---------------------------------
+MINUTES_PER_DAY = 24 * 60
+
+def parse_hhmm(value: Any) -> Optional[int]:
+    """"HH:MM" → minutes since midnight, or None when unparseable."""
+    try:
+        h, m = str(value).split(":")
+        h, m = int(h), int(m)
+    except (ValueError, TypeError):
+        return None
+    if not (0 <= h < 24 and 0 <= m < 60):
+        return None
+    return h * 60 + m
+
+def format_hhmm(minutes: int) -> str:
+    minutes %= MINUTES_PER_DAY
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def span_minutes(start: Optional[int], end: Optional[int]) -> Optional[int]:
+    """Length of start→end; an end before the start wraps past midnight, and start == end is 0 (not 24 h)."""
+    if start is None or end is None:
+        return None
+    return (end - start) % MINUTES_PER_DAY
+
 # ---------------------------------
 # Data Models
 # ---------------------------------
-@dataclass
+@dataclass(slots=True)
 class StaffMember:
     staff_id: str
     name: str
@@ -44,8 +99,127 @@ class StaffMember:
     unavailable_days: List[str]
     roles: List[str] = field(default_factory=lambda: ["general"])  # NEW
     weekly_hours: float = 0.0
+    unavailable_dates: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "StaffMember":
+        # roles may be missing; default handled by dataclass. Unknown keys are ignored.
+        kw = {k: d[k] for k in cls.__dataclass_fields__ if k in d}
+        if kw.get("roles") is None:
+            kw.pop("roles", None)
+        return cls(**kw)
+
+WEEKDAYS = ("monday","tuesday","wednesday","thursday","friday","saturday","sunday")
+
+class AvailabilityIndex:
+    """
+    Bitmasks over staff positions (bit i ↔ members[i]), built once per request:
+    who is off on each weekday, who is off on each specific date, and who can
+    work each role. Candidate filtering becomes a few integer ANDs.
+    """
+
+    def __init__(self, members: List[StaffMember]):
+        self.members = members
+        self.all = (1 << len(members)) - 1
+        off_weekday = dict.fromkeys(WEEKDAYS, 0)
+        self._off_date: Dict[str, int] = {}
+        self._role: Dict[str, int] = {}
+        self._general = 0
+        for i, m in enumerate(members):
+            bit = 1 << i
+            for d in m.unavailable_days:
+                key = str(d).lower()
+                off_weekday[key] = off_weekday.get(key, 0) | bit
+            for d in m.unavailable_dates:
+                self._off_date[d] = self._off_date.get(d, 0) | bit
+            for r in m.roles:
+                self._role[r] = self._role.get(r, 0) | bit
+            if "general" in m.roles:
+                self._general |= bit
+        self._on_weekday = [self.all & ~off_weekday[d] for d in WEEKDAYS]
+        self._on_date: Dict[str, int] = {}
+
+    def available(self, date: str) -> int:
+        """Staff not off on date's weekday or on the date itself."""
+        mask = self._on_date.get(date)
+        if mask is None:
+            wd = datetime.strptime(date, "%Y-%m-%d").weekday()
+            mask = self._on_weekday[wd] & ~self._off_date.get(date, 0)
+            self._on_date[date] = mask
+        return mask
+
+    def eligible(self, role: str) -> int:
+        """Staff holding role, or the catch-all "general" role."""
+        return self._role.get(role, 0) | self._general
+
+    def candidates(self, date: str, role: str) -> int:
+        return self.available(date) & self.eligible(role)
+
+    def derive(self, members: List[StaffMember], off: Optional[Dict[int, List[str]]] = None) -> "AvailabilityIndex":
+        """
+        The same index over a position-for-position copy of members, plus extra
+        dates off per position. Weekday and role masks are shared, not rebuilt.
+        """
+        idx = object.__new__(AvailabilityIndex)
+        idx.members = members
+        idx.all = self.all
+        idx._role = self._role
+        idx._general = self._general
+        idx._on_weekday = self._on_weekday
+        idx._off_date = dict(self._off_date)
+        for i, dates in (off or {}).items():
+            for d in dates:
+                idx._off_date[d] = idx._off_date.get(d, 0) | (1 << i)
+        idx._on_date = {} if off else dict(self._on_date)
+        return idx
+
+    def members_of(self, mask: int):
+        """Yield (position, member) for set bits, in registry order."""
+        while mask:
+            low = mask & -mask
+            i = low.bit_length() - 1
+            yield i, self.members[i]
+            mask ^= low
+
+class StaffRegistry:
+    """Staff list indexed by staff_id; lives for one optimize()/update_schedule() call."""
+
+    def __init__(self, members: List[StaffMember]):
+        self.members = list(members)
+        self._by_id: Dict[str, StaffMember] = {}
+        for m in self.members:
+            self._by_id.setdefault(m.staff_id, m)
+        self._availability: Optional[AvailabilityIndex] = None
+
+    @property
+    def availability(self) -> AvailabilityIndex:
+        if self._availability is None:
+            self._availability = AvailabilityIndex(self.members)
+        return self._availability
+
+    def get(self, staff_id: str) -> Optional[StaffMember]:
+        return self._by_id.get(staff_id)
+
+    def copy(self, leave: Optional[Dict[str, List[str]]] = None) -> "StaffRegistry":
+        """
+        Independent members (optimizing mutates weekly_hours), optionally with
+        extra unavailable dates per staff_id, reusing this availability index.
+        """
+        leave = leave or {}
+        members = [replace(m, unavailable_dates=[*m.unavailable_dates, *leave[m.staff_id]])
+                   if m.staff_id in leave else replace(m) for m in self.members]
+        reg = StaffRegistry(members)
+        off = {i: leave[m.staff_id] for i, m in enumerate(members) if m.staff_id in leave}
+        reg._availability = self.availability.derive(reg.members, off)
+        return reg
+
+    def __iter__(self):
+        return iter(self.members)
 
-@dataclass
+    def __len__(self):
+        return len(self.members)
+
+@dataclass(slots=True)
 class Shift:
     shift_id: str
     staff_id: str
@@ -55,27 +229,1123 @@ class Shift:
     role: str
     is_owner_created: bool = True
     is_optimized: bool = False
+    start_min: Optional[int] = field(default=None, repr=False)
+    end_min: Optional[int] = field(default=None, repr=False)
+
+    @property
+    def minutes(self) -> Optional[int]:
+        return span_minutes(self.start_min, self.end_min)
+
+    @property
+    def hours(self) -> float:
+        m = self.minutes
+        return 8 if m is None else m / 60
+
+class ShiftStore:
+    """
+    Columnar shifts for holding or passing around large schedules: one row per
+    shift in parallel NumPy arrays (staff code, date ordinal, start/end minutes,
+    role code, flags) plus small string tables, instead of a Shift object with
+    its own strings. Ids in the optimizer's "opt_<date><staff><role>_NNNNNN"
+    form are kept as their number (~19 bytes a row); any other id as
+    fixed-width bytes. Payroll is computed straight from the columns. The
+    engine accepts a store anywhere it takes a schedule, but plans on Shift
+    objects, so a run materialises the rows with to_shifts() first.
+    """
+    OWNER = 1
+    OPTIMIZED = 2
+    _NO_TIME = -1
+
+    def __init__(self, staff_code, date_ord, start_min, end_min, role_code, flags,
+                 staff_ids: List[str], roles: List[str], shift_ids: np.ndarray, id_seq: np.ndarray):
+        self.staff_code = staff_code
+        self.date_ord = date_ord
+        self.start_min = start_min
+        self.end_min = end_min
+        self.role_code = role_code
+        self.flags = flags
+        self.staff_ids = staff_ids
+        self.roles = roles
+        self.shift_ids = shift_ids
+        self.id_seq = id_seq   # NNNNNN of an optimizer-form id, -1 where shift_ids holds the id
+
+    @classmethod
+    def from_shifts(cls, shifts: List[Shift]) -> "ShiftStore":
+        staff_ids: Dict[str, int] = {}
+        roles: Dict[str, int] = {}
+        n = len(shifts)
+        staff_code = np.empty(n, dtype=np.int32)
+        date_ord = np.zeros(n, dtype=np.int32)
+        start_min = np.empty(n, dtype=np.int16)
+        end_min = np.empty(n, dtype=np.int16)
+        role_code = np.empty(n, dtype=np.int16)
+        flags = np.zeros(n, dtype=np.uint8)
+        id_seq = np.full(n, -1, dtype=np.int32)
+        ids = []
+        ordinals: Dict[str, int] = {}
+        isos: Dict[int, str] = {}
+        for i, sh in enumerate(shifts):
+            staff_code[i] = staff_ids.setdefault(sh.staff_id, len(staff_ids))
+            role_code[i] = roles.setdefault(sh.role, len(roles))
+            o = ordinals.get(sh.date)
+            if o is None:
+                try:
+                    o = ordinals[sh.date] = date.fromisoformat(sh.date).toordinal()
+                except (TypeError, ValueError):
+                    o = ordinals[sh.date] = 0
+            date_ord[i] = o
+            iso = isos.get(o)
+            if iso is None:
+                iso = isos[o] = date.fromordinal(o).isoformat() if o else ""
+            st = sh.start_min if sh.start_min is not None else parse_hhmm(sh.start_time)
+            et = sh.end_min if sh.end_min is not None else parse_hhmm(sh.end_time)
+            start_min[i] = cls._NO_TIME if st is None else st
+            end_min[i] = cls._NO_TIME if et is None else et
+            flags[i] = (cls.OWNER if sh.is_owner_created else 0) | (cls.OPTIMIZED if sh.is_optimized else 0)
+            # Keep just the number when to_shifts() rebuilds exactly this id
+            shift_id = str(sh.shift_id)
+            base = f"opt_{iso}{sh.staff_id}{sh.role}_"
+            seq = shift_id[len(base):] if shift_id.startswith(base) else ""
+            if seq.isascii() and seq.isdigit() and len(seq) <= 9 and f"{int(seq):06d}" == seq:
+                id_seq[i] = int(seq)
+                ids.append(b"")
+            else:
+                ids.append(shift_id.encode())
+        return cls(staff_code, date_ord, start_min, end_min, role_code, flags,
+                   list(staff_ids), list(roles), np.array(ids, dtype=bytes) if ids else np.array([], dtype="S1"),
+                   id_seq)
+
+    def __len__(self):
+        return len(self.staff_code)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.staff_code, self.date_ord, self.start_min, self.end_min,
+                                      self.role_code, self.flags, self.shift_ids, self.id_seq))
+
+    def dates(self) -> List[str]:
+        """ISO date per row ('' where the input date was unparseable)."""
+        table = {o: (date.fromordinal(int(o)).isoformat() if o else "") for o in np.unique(self.date_ord)}
+        return [table[o] for o in self.date_ord.tolist()]
+
+    def minutes(self) -> np.ndarray:
+        """Shift length in minutes (wrapping past midnight); -1 where a time was unparseable."""
+        m = (self.end_min.astype(np.int32) - self.start_min) % MINUTES_PER_DAY
+        return np.where((self.start_min < 0) | (self.end_min < 0), -1, m)
+
+    def hours(self) -> np.ndarray:
+        m = self.minutes()
+        return np.where(m < 0, 8.0, m / 60)
+
+    def rates(self, staff: StaffRegistry) -> np.ndarray:
+        """Hourly rate per row; NaN where the staff member is unknown."""
+        table = np.array([getattr(staff.get(sid), "hourly_rate", np.nan) for sid in self.staff_ids] or [np.nan],
+                         dtype=float)
+        return table[self.staff_code]
+
+    def payroll(self, staff: StaffRegistry) -> Dict[str, Any]:
+        """Payroll breakdown straight from the columns (see PayrollLedger)."""
+        return PayrollLedger.from_store(self, staff).breakdown()
+
+    def to_shifts(self) -> List[Shift]:
+        dates = self.dates()
+        out = []
+        for i in range(len(self)):
+            st, et, fl = int(self.start_min[i]), int(self.end_min[i]), int(self.flags[i])
+            sid, role = self.staff_ids[self.staff_code[i]], self.roles[self.role_code[i]]
+            seq = int(self.id_seq[i])
+            shift_id = f"opt_{dates[i]}{sid}{role}_{seq:06d}" if seq >= 0 else self.shift_ids[i].decode()
+            out.append(Shift(
+                shift_id=shift_id, staff_id=sid, date=dates[i],
+                start_time=format_hhmm(st) if st >= 0 else "", end_time=format_hhmm(et) if et >= 0 else "",
+                role=role, is_owner_created=bool(fl & self.OWNER), is_optimized=bool(fl & self.OPTIMIZED),
+                start_min=st if st >= 0 else None, end_min=et if et >= 0 else None,
+            ))
+        return out
+
+class IntervalIndex:
+    """
+    Each person's shifts per date, for "does [start, end) overlap anything that
+    day?" and the day's booked hours. A date is indexed from the schedule's
+    bucket the first time it is queried and kept in step from then on, so dates
+    nobody asks about cost nothing. People rarely hold more than one or two
+    shifts a day, so queries scan that short list. A shift past midnight ends
+    after 1440 on its own date; shifts without parseable times count towards
+    hours but never overlap.
+    """
+
+    def __init__(self, by_date: Dict[str, Dict[int, Shift]]):
+        self._by_date = by_date
+        self._days: Dict[str, Dict[str, List[Shift]]] = {}
+
+    def add(self, sh: Shift):
+        day = self._days.get(sh.date)
+        if day is not None:
+            day.setdefault(sh.staff_id, []).append(sh)
+
+    def remove(self, sh: Shift):
+        day = self._days.get(sh.date)
+        if day is not None:
+            held = day[sh.staff_id]
+            del held[next(i for i, x in enumerate(held) if x is sh)]
+
+    def _held(self, staff_id: str, date: str) -> List[Shift]:
+        day = self._days.get(date)
+        if day is None:
+            day = self._days[date] = {}
+            for sh in self._by_date.get(date, {}).values():
+                day.setdefault(sh.staff_id, []).append(sh)
+        return day.get(staff_id, [])
+
+    def overlaps(self, staff_id: str, date: str, start: int, end: int) -> bool:
+        span = span_minutes(start, end)
+        if span is None:
+            return False
+        end = start + span
+        for sh in self._held(staff_id, date):
+            m = sh.minutes
+            if m is not None and sh.start_min < end and start < sh.start_min + m:
+                return True
+        return False
+
+    def day_hours(self, staff_id: str, date: str) -> float:
+        return sum(sh.hours for sh in self._held(staff_id, date))
+
+class ScheduleState:
+    """
+    Working schedule for one optimization run. Shifts are bucketed by date with
+    live per-role counters, and each add/remove keeps the staff member's
+    weekly_hours in step, all in O(1). An IntervalIndex tracks each person's
+    intervals and hours per date for overlap and daily-hours checks.
+    """
+
+    def __init__(self, shifts: List[Shift], staff: StaffRegistry):
+        self._staff = staff
+        self._all: Dict[int, Shift] = {}
+        self._by_date: Dict[str, Dict[int, Shift]] = {}
+        self._roles: Dict[str, Dict[str, int]] = {}
+        self.intervals = IntervalIndex(self._by_date)
+        self._ids = {sh.shift_id for sh in shifts}
+        for sh in shifts:
+            self.add(sh)
+
+    def add(self, sh: Shift):
+        self._all[id(sh)] = sh
+        self._by_date.setdefault(sh.date, {})[id(sh)] = sh
+        roles = self._roles.setdefault(sh.date, {})
+        roles[sh.role] = roles.get(sh.role, 0) + 1
+        self.intervals.add(sh)
+        st = self._staff.get(sh.staff_id)
+        if st:
+            st.weekly_hours += sh.hours
+
+    def remove(self, sh: Shift):
+        del self._all[id(sh)]
+        del self._by_date[sh.date][id(sh)]
+        self._roles[sh.date][sh.role] -= 1
+        self.intervals.remove(sh)
+        st = self._staff.get(sh.staff_id)
+        if st:
+            st.weekly_hours -= sh.hours
+
+    def fits(self, staff_id: str, date: str, start: int, end: int, max_hours_per_day: float) -> bool:
+        """Would a start–end shift leave staff_id overlap-free and within max_hours_per_day on date?"""
+        span = span_minutes(start, end)
+        hours = 8 if span is None else span / 60
+        return (self.intervals.day_hours(staff_id, date) + hours <= max_hours_per_day
+                and not self.intervals.overlaps(staff_id, date, start, end))
+
+    def new_shift_id(self, base: str) -> str:
+        """First free "<base>_NNNNNN": the same input always yields the same ids."""
+        n = 0
+        while f"{base}_{n:06d}" in self._ids:
+            n += 1
+        sid = f"{base}_{n:06d}"
+        self._ids.add(sid)
+        return sid
+
+    def on_date(self, date: str) -> List[Shift]:
+        return list(self._by_date.get(date, {}).values())
+
+    def count(self, date: str) -> int:
+        return len(self._by_date.get(date, ()))
+
+    def role_count(self, date: str, role: str) -> int:
+        return self._roles.get(date, {}).get(role, 0)
+
+    def shifts(self) -> List[Shift]:
+        return list(self._all.values())
+
+# ---------------------------------
+# Payroll
+# ---------------------------------
+def _encode(values: List[Any]) -> Tuple[List[Any], np.ndarray]:
+    """Distinct values in first-seen order and the int32 code of every input value."""
+    table: Dict[Any, int] = {}
+    codes = np.fromiter((table.setdefault(v, len(table)) for v in values), dtype=np.int32, count=len(values))
+    return list(table), codes
+
+def _iso_week(day: str) -> str:
+    try:
+        y, w, _ = date.fromisoformat(day).isocalendar()
+    except (TypeError, ValueError):
+        return ""
+    return f"{y}-W{w:02d}"
+
+class PayrollLedger:
+    """
+    Columnar payroll: one row per costed shift as parallel arrays (staff code, day
+    code, role code, hours, hourly rate). breakdown() totals per staff_id, day,
+    role and ISO week with np.bincount, and overtime hours beyond each person's
+    max_hours_per_week in every week.
+    """
+    # flat_shifts keys that from_columns() takes, in its argument order
+    ROW_COLUMNS = ("staff_id", "date", "role", "hours", "hourly_rate")
+
+    def __init__(self, staff: StaffRegistry, staff_ids: List[str], staff_code: np.ndarray, days: List[str],
+                 day_code: np.ndarray, roles: List[str], role_code: np.ndarray,
+                 hours: np.ndarray, rates: np.ndarray):
+        self.staff = staff
+        self.staff_ids, self.staff_code = staff_ids, staff_code
+        self.days, self.day_code = days, day_code
+        self.roles, self.role_code = roles, role_code
+        self.hours = np.asarray(hours, dtype=float)
+        self.rates = np.asarray(rates, dtype=float)
+
+    @classmethod
+    def from_columns(cls, staff: StaffRegistry, staff_ids: List[str], dates: List[str], roles: List[str],
+                     hours: List[float], rates: List[float]) -> "PayrollLedger":
+        sids, staff_code = _encode(staff_ids)
+        days, day_code = _encode(dates)
+        role_names, role_code = _encode(roles)
+        return cls(staff, sids, staff_code, days, day_code, role_names, role_code, hours, rates)
+
+    @classmethod
+    def from_rows(cls, staff: StaffRegistry, rows: List[Dict[str, Any]]) -> "PayrollLedger":
+        """From costed output rows (flat_shifts entries)."""
+        return cls.from_columns(staff, *([r[k] for r in rows] for k in cls.ROW_COLUMNS))
+
+    @classmethod
+    def from_store(cls, store: "ShiftStore", staff: StaffRegistry) -> "PayrollLedger":
+        """Rows of staff the registry does not know are left out, as in the flat output."""
+        rates = store.rates(staff)
+        keep = ~np.isnan(rates)
+        ords, day_code = np.unique(store.date_ord[keep], return_inverse=True)
+        days = [date.fromordinal(int(o)).isoformat() if o else "" for o in ords]
+        return cls(staff, store.staff_ids, store.staff_code[keep], days, day_code.astype(np.int32),
+                   store.roles, store.role_code[keep], store.hours()[keep], rates[keep])
+
+    def __len__(self):
+        return len(self.hours)
+
+    def breakdown(self) -> Dict[str, Any]:
+        hours, cost = self.hours, self.hours * self.rates
+        n_staff = len(self.staff_ids)
+
+        def totals(code: np.ndarray, n: int):
+            return (np.bincount(code, minlength=n).tolist(),
+                    np.bincount(code, weights=hours, minlength=n).tolist(),
+                    np.bincount(code, weights=cost, minlength=n).tolist())
+
+        def table(labels: List[str], sums, overtime: Optional[List[float]] = None):
+            out = {}
+            for i, label in enumerate(labels):
+                n, h, c = sums[0][i], sums[1][i], sums[2][i]
+                if not n:
+                    continue
+                out[label] = {"shifts": n, "hours": round(h, 2), "cost": round(c, 2)}
+                if overtime is not None:
+                    out[label]["overtime_hours"] = round(overtime[i], 2)
+            return out
+
+        weeks, week_of_day = _encode([_iso_week(d) for d in self.days])
+        n_weeks = len(weeks)
+        week_code = week_of_day[self.day_code] if len(self) else np.zeros(0, dtype=np.int32)
+        # Hours per (staff, week) against that person's weekly cap
+        per_week = np.bincount(self.staff_code.astype(np.int64) * n_weeks + week_code, weights=hours,
+                               minlength=n_staff * n_weeks).reshape(n_staff, n_weeks)
+        cap = np.array([getattr(self.staff.get(sid), "max_hours_per_week", np.inf) for sid in self.staff_ids],
+                       dtype=float).reshape(n_staff, 1)
+        overtime = np.maximum(per_week - cap, 0.0)
+        if "" in weeks:
+            overtime[:, weeks.index("")] = 0.0  # unparseable dates belong to no week
+
+        by_staff = table(self.staff_ids, totals(self.staff_code, n_staff), overtime.sum(axis=1).tolist())
+        for sid, row in by_staff.items():
+            s = self.staff.get(sid)
+            row["name"] = s.name if s else "?"
+            row["max_hours_per_week"] = s.max_hours_per_week if s else None
+        return {
+            "by_staff": by_staff,
+            "by_day": table(self.days, totals(self.day_code, len(self.days))),
+            "by_role": table(self.roles, totals(self.role_code, len(self.roles))),
+            "by_week": table(weeks, totals(week_code, n_weeks), overtime.sum(axis=0).tolist()),
+            "totals": {"shifts": len(self), "hours": round(float(hours.sum()), 2),
+                       "cost": round(float(cost.sum()), 2),
+                       "overtime_hours": round(float(overtime.sum()), 2)},
+        }
+
+# ---------------------------------
+# Model Registry
+# ---------------------------------
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_PATH = "staff_rf_model.pkl"
+# How often (seconds) a registry re-stats its model file to pick up a new one
+MODEL_RELOAD_INTERVAL_S = float(os.getenv("MODEL_RELOAD_INTERVAL_S", "5"))
+# Feature columns the staffing model is fed (train_model.py fits on the same matrix)
+MODEL_FEATURES = (
+    "store_id","store_size_sqft","day_of_week","is_weekend","sales",
+    "diwali_flag","holi_flag","eid_flag","christmas_flag","independence_flag",
+    "month","year","dayofmonth","weekofyear",
+    "city_Hyderabad","city_Mumbai","city_Pune",
+)
+# Applied by ScheduleEngine._predict on top of the model output (train_model.py divides them out)
+WEEKEND_MULTIPLIER = 1.2
+FESTIVE_MULTIPLIER = 1.5
+FESTIVE_FLAGS = ("diwali_flag", "christmas_flag")
+
+def _load_model_or_demo(path: str):
+    """Load a pickled model (numpy arrays memory-mapped), or fall back to the demo predictor."""
+    try:
+        return joblib.load(path, mmap_mode="r"), False
+    except Exception:
+        logger.warning("⚠ Model not found, using demo predictor.")
+        from sklearn.ensemble import RandomForestRegressor
+        demo = RandomForestRegressor(n_estimators=5, random_state=42)
+        X = np.array([[1,3500,4,0],[1,3500,6,1]])
+        y = np.array([4.0,8.0])
+        demo.fit(X,y)
+        class Wrapper:
+            def predict(self,X):
+                df = pd.DataFrame(X)
+                sales = df.get("sales", pd.Series([20000]*len(df)))
+                weekend = df.get("is_weekend", pd.Series([0]*len(df)))
+                diwali  = df.get("diwali_flag", pd.Series([0]*len(df)))
+                base = (sales/8000) + weekend*2 + diwali*3
+                return base.clip(1,20)
+        return Wrapper(), True
+
+# Serve fitted RandomForest/ExtraTrees regressors as a CompiledForest, cached as
+# "<model>.forest.npz" next to the model (or in FOREST_CACHE_DIR)
+FOREST_COMPILE = os.getenv("FOREST_COMPILE", "1").lower() not in ("0", "false", "no")
+FOREST_CACHE_DIR = os.getenv("FOREST_CACHE_DIR") or None
+
+def _mmap_npz(path: str) -> Dict[str, np.ndarray]:
+    """
+    Members of an .npz as arrays memory-mapped read-only in place (np.load reads
+    npz members into memory). Compressed, object and 0-d members are read normally.
+    """
+    out = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type == zipfile.ZIP_STORED:
+                # Member data starts after its local header (30 bytes + name + extra field)
+                f.seek(info.header_offset + 26)
+                name_len, extra_len = struct.unpack("<HH", f.read(4))
+                f.seek(info.header_offset + 30 + name_len + extra_len)
+                version = np.lib.format.read_magic(f)
+                read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                               else np.lib.format.read_array_header_2_0)
+                shape, fortran, dtype = read_header(f)
+                if shape and not dtype.hasobject and math.prod(shape) > 0:
+                    out[name] = np.asarray(np.memmap(path, dtype=dtype, mode="r", offset=f.tell(),
+                                                     shape=shape, order="F" if fortran else "C"))
+                    continue
+            with zf.open(info) as member:
+                out[name] = np.lib.format.read_array(member)
+    return out
+
+class CompiledForest:
+    """
+    A fitted single-output RandomForestRegressor/ExtraTreesRegressor flattened
+    into NumPy node arrays, all trees back to back (roots = each tree's first
+    node, children[2n] / children[2n + 1] = left / right child of node n).
+    predict() walks every tree for a block of rows at once in max_depth
+    vectorized steps; leaves point at themselves, so finished paths stand still.
+    Rows are cast to float32 and leaf values summed tree by tree, as sklearn
+    does, so predictions match sklearn's. save()/load() use an uncompressed .npz
+    that load() memory-maps, so workers share one copy of the nodes.
+    """
+
+    ARRAYS = ("feature", "threshold", "children", "missing_left", "value", "roots")
+    BLOCK_ROWS = 4096
+
+    def __init__(self, feature, threshold, children, missing_left, value, roots, max_depth: int,
+                 feature_names: Optional[List[str]] = None, version: Optional[str] = None):
+        self.feature, self.threshold = feature, threshold
+        self.children, self.missing_left = children, missing_left
+        self.value, self.roots = value, roots
+        self.max_depth = max_depth
+        self.feature_names = feature_names
+        self.version = version
+
+    @staticmethod
+    def supports(model) -> bool:
+        try:
+            from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+        except ImportError:
+            return False
+        return (isinstance(model, (RandomForestRegressor, ExtraTreesRegressor))
+                and hasattr(model, "estimators_") and model.n_outputs_ == 1)
+
+    @classmethod
+    def from_sklearn(cls, model, version: Optional[str] = None) -> "CompiledForest":
+        parts: Dict[str, List[np.ndarray]] = {k: [] for k in cls.ARRAYS}
+        offset = 0
+        for est in model.estimators_:
+            t = est.tree_
+            node = np.arange(t.node_count, dtype=np.int64) + offset
+            leaf = t.children_left < 0
+            parts["feature"].append(np.where(leaf, 0, t.feature).astype(np.int64))
+            parts["threshold"].append(np.asarray(t.threshold, dtype=np.float64))
+            parts["children"].append(np.stack([np.where(leaf, node, t.children_left + offset),
+                                               np.where(leaf, node, t.children_right + offset)], axis=1).ravel())
+            missing = getattr(t, "missing_go_to_left", None)
+            parts["missing_left"].append(np.zeros(t.node_count, dtype=bool) if missing is None
+                                         else np.asarray(missing, dtype=bool))
+            parts["value"].append(np.asarray(t.value, dtype=np.float64).reshape(t.node_count, -1)[:, 0])
+            parts["roots"].append(np.array([offset], dtype=np.int64))
+            offset += t.node_count
+        names = getattr(model, "feature_names_in_", None)
+        return cls(**{k: np.concatenate(v) for k, v in parts.items()},
+                   max_depth=max(est.tree_.max_depth for est in model.estimators_),
+                   feature_names=None if names is None else [str(n) for n in names],
+                   version=version)
+
+    @property
+    def feature_names_in_(self) -> Optional[np.ndarray]:
+        return None if self.feature_names is None else np.asarray(self.feature_names, dtype=object)
+
+    def predict(self, X) -> np.ndarray:
+        if isinstance(X, pd.DataFrame):
+            if self.feature_names is not None:
+                X = X.reindex(columns=self.feature_names, fill_value=0)
+            X = X.to_numpy()
+        X = np.asarray(X, dtype=np.float32)  # sklearn's tree input dtype
+        if X.ndim != 2 or (self.feature_names is not None and X.shape[1] != len(self.feature_names)):
+            raise ValueError(f"Expected rows of {len(self.feature_names or [])} features, got shape {X.shape}")
+        out = np.empty(len(X), dtype=np.float64)
+        for lo in range(0, len(X), self.BLOCK_ROWS):
+            out[lo:lo + self.BLOCK_ROWS] = self._predict_block(X[lo:lo + self.BLOCK_ROWS])
+        return out
+
+    def _predict_block(self, X: np.ndarray) -> np.ndarray:
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        row_start = (np.arange(n_rows, dtype=np.int64) * n_features)[:, None]
+        node = np.tile(self.roots, (n_rows, 1))
+        has_nan = bool(np.isnan(X).any())
+        for _ in range(self.max_depth):
+            x = flat.take(row_start + self.feature.take(node))
+            go_right = ~(x <= self.threshold.take(node))
+            if has_nan:
+                go_right = np.where(np.isnan(x), ~self.missing_left.take(node), go_right)
+            node = self.children.take(2 * node + go_right)
+        # Running sum in tree order (not a pairwise sum) to reproduce sklearn's float rounding
+        return np.cumsum(self.value.take(node), axis=1)[:, -1] / len(self.roots)
+
+    def save(self, path: str):
+        """Write atomically, so a worker never maps a half-written file."""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **{k: getattr(self, k) for k in self.ARRAYS},
+                     max_depth=np.int64(self.max_depth),
+                     feature_names=np.array(self.feature_names or [], dtype=str),
+                     has_names=np.bool_(self.feature_names is not None),
+                     version=np.array(self.version or ""))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledForest":
+        a = _mmap_npz(path)
+        return cls(**{k: a[k] for k in cls.ARRAYS}, max_depth=int(a["max_depth"]),
+                   feature_names=[str(n) for n in a["feature_names"]] if bool(a["has_names"]) else None,
+                   version=str(a["version"]) or None)
+
+class ModelRegistry:
+    """
+    One model per file per process. Loaded lazily on first use and reloaded
+    when the file's mtime/size changes (checked at most every reload_interval_s).
+    Forests are served as a CompiledForest from a memory-mapped .npz cache
+    (rebuilt when the model version changes); other models are loaded with
+    joblib memory-mapping. Either way workers forked after the load share its pages.
+    """
+
+    def __init__(self, path: str, reload_interval_s: float = MODEL_RELOAD_INTERVAL_S):
+        self.path = path
+        self.reload_interval_s = reload_interval_s
+        self._lock = threading.Lock()
+        self._model = None
+        self._stamp: Optional[Tuple[float, int]] = None
+        self._checked = 0.0
+        self.is_demo = False
+        self.version: Optional[str] = None
+        self.load_time_ms: Optional[float] = None
+        self.loaded_at: Optional[str] = None
+        self.reloads = 0
+
+    def get(self):
+        now = time.monotonic()
+        if self._model is not None and now - self._checked < self.reload_interval_s:
+            return self._model
+        with self._lock:
+            if self._model is None or now - self._checked >= self.reload_interval_s:
+                self._checked = now
+                stamp = self._file_stamp()
+                if self._model is None or stamp != self._stamp:
+                    self._load(stamp)
+        return self._model
+
+    def _file_stamp(self) -> Optional[Tuple[float, int]]:
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+
+    def _forest_cache_path(self) -> str:
+        stem = os.path.splitext(os.path.basename(self.path))[0]
+        return os.path.join(FOREST_CACHE_DIR or os.path.dirname(self.path), f"{stem}.forest.npz")
+
+    def _load_model(self, stamp):
+        """(model, is_demo, version), trying the compiled forest cache before unpickling the model."""
+        version = self._read_version(stamp) if stamp else None
+        # The cache must match the file too: a sidecar version can change before or after the model is swapped
+        tag = json.dumps([version, *stamp]) if stamp else None
+        cache = self._forest_cache_path()
+        if FOREST_COMPILE and version and os.path.exists(cache):
+            try:
+                forest = CompiledForest.load(cache)
+                if forest.version == tag:
+                    return forest, False, version
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                logger.warning(f"Ignoring forest cache {cache}: {e}")
+        model, is_demo = _load_model_or_demo(self.path)
+        if is_demo or not FOREST_COMPILE or not CompiledForest.supports(model):
+            return model, is_demo, "demo" if is_demo else version
+        forest = CompiledForest.from_sklearn(model, tag)
+        try:
+            forest.save(cache)
+            forest = CompiledForest.load(cache)
+        except OSError as e:
+            logger.warning(f"Could not write forest cache {cache}: {e}")
+        return forest, False, version
+
+    def _load(self, stamp):
+        t0 = time.perf_counter()
+        model, is_demo, version = self._load_model(stamp)
+        if self._model is not None:
+            self.reloads += 1
+            logger.info(f"Reloaded model {self.path}")
+        self._model, self.is_demo, self._stamp = model, is_demo, stamp
+        self.load_time_ms = round((time.perf_counter() - t0) * 1000, 1)
+        self.loaded_at = datetime.now().isoformat()
+        self.version = version
+
+    def _read_version(self, stamp) -> str:
+        # A "<model>.meta.json" sidecar with a "version" wins; otherwise a content hash.
+        # A sidecar stamped for another model file (mid-publish) is ignored.
+        meta_path = os.path.splitext(self.path)[0] + ".meta.json"
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            version, owner = meta.get("version"), meta.get("model_stamp")
+            if version and (owner is None or tuple(owner) == tuple(stamp)):
+                return str(version)
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+        h = hashlib.sha1()
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()[:12]
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "loaded": self._model is not None,
+            "is_demo": self.is_demo,
+            "version": self.version,
+            "compiled": isinstance(self._model, CompiledForest),
+            "load_time_ms": self.load_time_ms,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+        }
+
+_model_registries: Dict[str, ModelRegistry] = {}
+_model_registries_lock = threading.Lock()
+
+def get_model_registry(path: str = DEFAULT_MODEL_PATH) -> ModelRegistry:
+    """Process-wide registry for path (relative paths resolve next to this file)."""
+    if not os.path.isabs(path):
+        path = os.path.join(MODEL_DIR, path)
+    with _model_registries_lock:
+        reg = _model_registries.get(path)
+        if reg is None:
+            reg = _model_registries[path] = ModelRegistry(path)
+        return reg
+
+# ---------------------------------
+# Prediction Cache
+# ---------------------------------
+class PredictionCache:
+    """
+    LRU + TTL cache of base model predictions (before multipliers and staff caps),
+    keyed by (model version, canonical feature vector). With disk_path set, entries
+    are also written to a SQLite file so they survive restarts and are shared by
+    workers on the same host.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_s: float = 3600.0, disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._mem: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions "
+                             "(key TEXT PRIMARY KEY, value REAL NOT NULL, created REAL NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def key(model_version: Optional[str], vector) -> str:
+        payload = json.dumps([model_version, [float(v) for v in vector]], separators=(",", ":"))
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[float]]:
+        now = time.time()
+        out: List[Optional[float]] = []
+        missing: List[int] = []
+        with self._lock:
+            for i, k in enumerate(keys):
+                hit = self._mem.get(k)
+                if hit is not None and now - hit[1] > self.ttl_s:
+                    del self._mem[k]
+                    self.evictions += 1
+                    hit = None
+                if hit is None:
+                    out.append(None)
+                    missing.append(i)
+                else:
+                    self._mem.move_to_end(k)
+                    out.append(hit[0])
+            if missing and self._db is not None:
+                found = self._disk_lookup([keys[i] for i in missing], now)
+                for i in missing:
+                    if keys[i] in found:
+                        out[i] = found[keys[i]][0]
+                        self._store(keys[i], *found[keys[i]])
+                        self.disk_hits += 1
+            n_miss = sum(1 for v in out if v is None)
+            self.misses += n_miss
+            self.hits += len(keys) - n_miss
+        return out
+
+    def put_many(self, items: List[Tuple[str, float]]):
+        now = time.time()
+        with self._lock:
+            for k, v in items:
+                self._store(k, v, now)
+            if self._db is not None and items:
+                self._db.executemany("INSERT OR REPLACE INTO predictions (key, value, created) VALUES (?, ?, ?)",
+                                     [(k, v, now) for k, v in items])
+                self._db.commit()
+
+    def _store(self, k: str, v: float, created: float):
+        self._mem[k] = (v, created)
+        self._mem.move_to_end(k)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_lookup(self, keys: List[str], now: float) -> Dict[str, Tuple[float, float]]:
+        found: Dict[str, Tuple[float, float]] = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self._db.execute(
+                f"SELECT key, value, created FROM predictions WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk).fetchall()
+            for k, v, created in rows:
+                if now - created <= self.ttl_s:
+                    found[k] = (v, created)
+        return found
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._mem),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "persistent": self._db is not None,
+        }
+
+class LRUCache:
+    """Thread-safe, size-bounded in-process LRU for arbitrary values."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._data), "max_entries": self.max_entries,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+class ResultCache:
+    """
+    Finished /schedule response bodies keyed by request content hash: a
+    size-bounded in-process LRU in front of an optional SQLite tier (disk_path,
+    least recently used rows beyond max_disk_entries pruned) that survives
+    restarts and is shared by workers on the same host.
+    """
+
+    def __init__(self, max_entries: int = 128, disk_path: Optional[str] = None, max_disk_entries: int = 1024):
+        self._mem = LRUCache(max_entries)
+        self.max_disk_entries = max_disk_entries
+        self.disk_hits = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                             "(key TEXT PRIMARY KEY, body BLOB NOT NULL, used REAL NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Canonical JSON (sorted keys, no whitespace) of parts → sha256 hex."""
+        payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        body = self._mem.get(key)
+        if body is None and self._db is not None:
+            with self._lock:
+                row = self._db.execute("SELECT body FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self.disk_hits += 1
+            if row is not None:
+                body = bytes(row[0])
+                self._mem.put(key, body)
+        return body
+
+    def put(self, key: str, body: bytes):
+        self._mem.put(key, body)
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("INSERT OR REPLACE INTO results (key, body, used) VALUES (?, ?, ?)",
+                                 (key, body, time.time()))
+                self._db.execute("DELETE FROM results WHERE key NOT IN "
+                                 "(SELECT key FROM results ORDER BY used DESC LIMIT ?)", (self.max_disk_entries,))
+                self._db.commit()
+
+    def clear(self):
+        self._mem.clear()
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._mem.stats(), "disk_hits": self.disk_hits, "persistent": self._db is not None}
+
+# ---------------------------------
+# Instrumentation
+# ---------------------------------
+# SCHEDULE_TIMINGS=1 traces every call (log lines + /metrics); otherwise only calls
+# that ask for metadata.timings are traced and the rest run against NULL_TRACE.
+TIMINGS_ENABLED = os.getenv("SCHEDULE_TIMINGS", "").lower() in ("1", "true", "yes")
+
+_CHANGE_COUNTERS = {"ADDED": "shifts_added", "REMOVED": "shifts_removed",
+                    "REASSIGNED": "shifts_reassigned", "ADJUSTED": "shifts_adjusted"}
+
+class MetricsRegistry:
+    """Process-wide totals per "<op>.<stage>": calls, wall time and summed counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, float]] = {}
+
+    def record(self, op: str, stages: Dict[str, Dict[str, float]]):
+        with self._lock:
+            for name, st in stages.items():
+                agg = self._stages.setdefault(f"{op}.{name}", {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+                agg["calls"] += 1
+                agg["total_ms"] += st["ms"]
+                agg["max_ms"] = max(agg["max_ms"], st["ms"])
+                for k, v in st.items():
+                    if k != "ms":
+                        agg[k] = agg.get(k, 0) + v
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {key: {**agg, "total_ms": round(agg["total_ms"], 3), "max_ms": round(agg["max_ms"], 3),
+                          "mean_ms": round(agg["total_ms"] / agg["calls"], 3)}
+                    for key, agg in self._stages.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+METRICS = MetricsRegistry()
+
+class StageTrace:
+    """
+    Wall time and counters per pipeline stage of one optimize()/update_schedule() call.
+    Counters go to the innermost open stage; finish() logs one structured line,
+    feeds METRICS and returns the metadata.timings block.
+    """
+    enabled = True
+
+    def __init__(self, op: str):
+        self.op = op
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._open: List[Dict[str, float]] = []
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        st = self.stages.setdefault(name, {"ms": 0.0})
+        self._open.append(st)
+        t0 = time.perf_counter()
+        try:
+            yield st
+        finally:
+            st["ms"] += (time.perf_counter() - t0) * 1000
+            self._open.pop()
+
+    def count(self, name: str, n: int = 1):
+        if self._open:
+            st = self._open[-1]
+            st[name] = st.get(name, 0) + n
+
+    def count_changes(self, changes: List[Dict[str, Any]]):
+        for c in changes:
+            key = _CHANGE_COUNTERS.get(c.get("type"))
+            if key:
+                self.count(key)
+
+    def finish(self) -> Dict[str, Any]:
+        total_ms = (time.perf_counter() - self._t0) * 1000
+        for st in self.stages.values():
+            st["ms"] = round(st["ms"], 3)
+        timings = {"total_ms": round(total_ms, 3), "stages": self.stages}
+        METRICS.record(self.op, {**self.stages, "total": {"ms": total_ms}})
+        logger.info("timings %s", json.dumps({"op": self.op, **timings}, separators=(",", ":")))
+        return timings
+
+class _NullTrace:
+    """Instrumentation switched off: every hook is a no-op."""
+    enabled = False
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+    def count_changes(self, changes: List[Dict[str, Any]]):
+        pass
+
+NULL_TRACE = _NullTrace()
+_active = threading.local()
+
+def current_trace():
+    """The trace of the call running on this thread (NULL_TRACE when none)."""
+    return getattr(_active, "trace", NULL_TRACE)
+
+@contextmanager
+def tracing(op: str, requested: bool = False):
+    trace = StageTrace(op) if (requested or TIMINGS_ENABLED) else NULL_TRACE
+    prev = current_trace()
+    _active.trace = trace
+    try:
+        yield trace
+    finally:
+        _active.trace = prev
+
+# ---------------------------------
+# Business-type rules
+# ---------------------------------
+# Role mix, weekend/festival adjustments, frontline order, removal priority and
+# intra-day profile per business type. Every entry inherits what it leaves out
+# from "general"; "aliases" are matched exactly and "prefixes" by str.startswith.
+BUSINESS_TYPES_PATH = os.getenv("BUSINESS_TYPES_PATH", os.path.join(MODEL_DIR, "business_types.json"))
+
+_FALLBACK_BUSINESS_TYPES = {"general": {
+    "mix": {"cashier": 0.35, "floor_exec": 0.35, "picker": 0.15, "qc": 0.05, "delivery": 0.10},
+    "frontline": ["cashier", "floor_exec", "general", "picker", "qc", "delivery"],
+    "removal_priority": {"cashier": 5, "floor_exec": 8, "general": 12, "picker": 15, "qc": 18, "delivery": 20, "*": 50},
+    "intraday_profile": [1,1,1,1,1,1,1,2,3,5,6,7,8,8,7,7,8,9,10,10,8,6,3,1],
+}}
+
+@dataclass(eq=False)
+class BusinessRules:
+    """One business type compiled to role-ordered vectors (fractions of predicted headcount)."""
+    name: str
+    roles: Tuple[str, ...]
+    ratios: np.ndarray
+    weekend: np.ndarray
+    festival: np.ndarray
+    festival_flags: Tuple[str, ...]
+    frontline: List[str]
+    removal_priority: Dict[str, int]
+    intraday_profile: List[float]
+
+    @classmethod
+    def compile(cls, name: str, spec: Dict[str, Any]) -> "BusinessRules":
+        roles = list(spec["mix"])
+        for adj in (spec.get("weekend", {}), spec.get("festival", {})):
+            roles += [r for r in adj if r not in roles]
+
+        def vector(weights: Dict[str, float]) -> np.ndarray:
+            return np.array([float(weights.get(r, 0.0)) for r in roles])
+
+        profile = [float(x) for x in spec["intraday_profile"]]
+        if len(profile) != 24:
+            raise ValueError(f"business type '{name}': intraday_profile needs 24 hourly values")
+        return cls(name=name, roles=tuple(roles), ratios=vector(spec["mix"]),
+                   weekend=vector(spec.get("weekend", {})), festival=vector(spec.get("festival", {})),
+                   festival_flags=tuple(spec.get("festival_flags", ())),
+                   frontline=list(spec["frontline"]), removal_priority=dict(spec["removal_priority"]),
+                   intraday_profile=profile)
+
+    def demand(self, dates: List[str], predicted: List[int],
+               features: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, int]]:
+        """
+        Role → required headcount for every date at once. Counts are rounded and
+        then nudged until they sum to the prediction: a shortfall goes to the
+        largest role, a surplus comes off whichever role is largest at each step.
+        """
+        if not dates:
+            return {}
+        pred = np.asarray(predicted, dtype=np.int64)
+        p = pred.astype(float)[:, None]
+        day = np.array(dates, dtype="datetime64[D]").astype(np.int64)
+        weekend = (day + 3) % 7 >= 5  # 1970-01-01 was a Thursday
+        mix = self.ratios * p
+        mix = np.where(weekend[:, None], mix + self.weekend * p, mix)
+        if features and self.festival_flags:
+            festive = np.array([any((features.get(d) or {}).get(f) for f in self.festival_flags) for d in dates])
+            mix = np.where(festive[:, None], mix + self.festival * p, mix)
+        ints = np.rint(np.maximum(mix, 0.0)).astype(np.int64)
+
+        total = ints.sum(axis=1)
+        live = (pred > 0) & (total > 0)
+        rows = np.arange(len(dates))
+        under = np.where(live, pred - total, 0).clip(min=0)
+        ints[rows, ints.argmax(axis=1)] += under
+        extra = np.where(live, total - pred, 0).clip(min=0)
+        for k in range(int(extra.max(initial=0))):
+            r = rows[extra > k]
+            j = ints[r].argmax(axis=1)
+            ints[r, j] -= ints[r, j] > 0
+
+        out: Dict[str, Dict[str, int]] = {}
+        for i, d in enumerate(dates):
+            if pred[i] <= 0:
+                out[d] = {}
+            elif total[i] == 0:
+                out[d] = {"general": int(pred[i])}
+            else:
+                out[d] = dict(zip(self.roles, ints[i].tolist()))
+        return out
+
+class BusinessRuleBook:
+    """Compiled rules for every configured business type, looked up by alias then prefix."""
+
+    def __init__(self, config: Dict[str, Dict[str, Any]]):
+        # Content hash of the loaded config: cached results are keyed on it
+        self.digest = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+        general = config.get("general") or _FALLBACK_BUSINESS_TYPES["general"]
+        self.types: Dict[str, BusinessRules] = {}
+        self._exact: Dict[str, BusinessRules] = {}
+        prefixes: List[Tuple[str, BusinessRules]] = []
+        for name, spec in {**config, "general": general}.items():
+            merged = {**general, **spec} if name != "general" else spec
+            rules = BusinessRules.compile(name, merged)
+            self.types[name] = rules
+            for alias in [name, *spec.get("aliases", ())]:
+                self._exact[alias.lower()] = rules
+            prefixes += [(pfx.lower(), rules) for pfx in spec.get("prefixes", ())]
+        self._prefixes = sorted(prefixes, key=lambda x: -len(x[0]))
+        self.default = self.types["general"]
+
+    @classmethod
+    def load(cls, path: str = BUSINESS_TYPES_PATH) -> "BusinessRuleBook":
+        try:
+            with open(path) as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠ Business-type rules not loaded from {path} ({e}); using general rules only.")
+            config = _FALLBACK_BUSINESS_TYPES
+        return cls(config)
+
+    def get(self, business_type: Optional[str]) -> BusinessRules:
+        bt = (business_type or "general").lower()
+        rules = self._exact.get(bt)
+        if rules is None:
+            rules = next((r for pfx, r in self._prefixes if bt.startswith(pfx)), self.default)
+            self._exact[bt] = rules
+        return rules
 
 # ---------------------------------
 # Schedule Engine
 # ---------------------------------
 class ScheduleEngine:
-    def _init_(self, model_path: str = "staff_rf_model.pkl"):
-        self.model = self._load_model_or_demo(model_path)
-        self.model_features = [
-            "store_id","store_size_sqft","day_of_week","is_weekend","sales",
-            "diwali_flag","holi_flag","eid_flag","christmas_flag","independence_flag",
-            "month","year","dayofmonth","weekofyear",
-            "city_Hyderabad","city_Mumbai","city_Pune"
-        ]
-        self.shift_templates = {
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH):
+        self.model_registry = get_model_registry(model_path)
+        self.model_features = list(MODEL_FEATURES)
+        self.shift_templates = self._compile_templates({
             "morning":  ("08:00", "16:00"),
             "afternoon":("12:00", "20:00"),
             "evening":  ("14:00", "22:00"),
             "full_day": ("09:00", "17:00")
-        }
+        })
         # Default role->shift template (fallback if no preferred shift)
-        self.role_shift_templates = {
+        self.role_shift_templates = self._compile_templates({
             "cashier": ("09:00","17:00"),
             "picker": ("08:00","16:00"),
             "packer_fragile": ("12:00","20:00"),
@@ -83,82 +1353,515 @@ class ScheduleEngine:
             "floor_exec": ("11:00","19:00"),
             "delivery": ("14:00","22:00"),
             "general": ("09:00","17:00")
-        }
+        })
+        self.default_shift = (parse_hhmm("09:00"), parse_hhmm("17:00"))
+        # Used by slot_minutes coverage when the payload has no business_hours for a day
+        self.default_business_hours = (parse_hhmm("08:00"), parse_hhmm("22:00"))
         self.max_hours_per_day = 10
+        # solver="optimal": fall back to greedy beyond these limits
+        self.optimal_solver_defaults = {
+            "max_variables": 50000,
+            "time_limit_ms": 2000,
+            "mip_rel_gap": 1e-4,
+        }
+        # time_budget_ms > 0: weights of the local-search objective
+        self.local_search_defaults = {
+            "cost_weight": 1.0,      # per currency unit of payroll
+            "mix_weight": 1000.0,    # per head off the business-type role mix
+            "spread_weight": 10.0,   # per hour² of weekly-hours variance
+            "seed": 0,
+        }
+        self.business_rules = BusinessRuleBook.load()
+        # horizon="weekly": finished week plans keyed by everything the week depends on
+        self.week_plan_cache = LRUCache(int(os.getenv("WEEK_PLAN_CACHE_SIZE", "256")))
+        self.prediction_cache = PredictionCache(
+            max_entries=int(os.getenv("PREDICTION_CACHE_SIZE", "10000")),
+            ttl_s=float(os.getenv("PREDICTION_CACHE_TTL_S", "3600")),
+            disk_path=os.getenv("PREDICTION_CACHE_PATH") or None,
+        )
 
-    # --- Model or demo predictor
-    def _load_model_or_demo(self, path):
-        try:
-            return joblib.load(path)
-        except Exception:
-            logger.warning("⚠ Model not found, using demo predictor.")
-            from sklearn.ensemble import RandomForestRegressor
-            import numpy as np
-            demo = RandomForestRegressor(n_estimators=5, random_state=42)
-            X = np.array([[1,3500,4,0],[1,3500,6,1]])
-            y = np.array([4.0,8.0])
-            demo.fit(X,y)
-            class Wrapper:
-                def predict(self,X):
-                    df = pd.DataFrame(X)
-                    sales = df.get("sales", pd.Series([20000]*len(df)))
-                    weekend = df.get("is_weekend", pd.Series([0]*len(df)))
-                    diwali  = df.get("diwali_flag", pd.Series([0]*len(df)))
-                    base = (sales/8000) + weekend*2 + diwali*3
-                    return base.clip(1,20)
-            return Wrapper()
+    @property
+    def model(self):
+        """The shared, lazily loaded predictor (hot-reloaded when the file changes)."""
+        return self.model_registry.get()
 
     # --- Public API
-    def optimize(self, staff_data, schedule_data, feature_lookup, business_type: Optional[str] = None):
-        staff  = self._to_staff(staff_data)
-        shifts = self._to_shifts(schedule_data)
-        feats  = self._normalize_features(feature_lookup, schedule_data)
-        preds  = self._predict(feats)
-        optimized, changes = self._apply_optimization(shifts, staff, preds, business_type)
-        result = self._build_output(staff, shifts, optimized, preds, changes, business_type)
-        # Optional LLM-style post-process (non-ML). No external calls by default.
-        result = self._maybe_llm_post_process(result, business_type)
+    def optimize(self, staff_data, schedule_data, feature_lookup, business_type: Optional[str] = None,
+                 solver: str = "greedy", solver_options: Optional[Dict[str, Any]] = None,
+                 time_budget_ms: Optional[float] = None, search_options: Optional[Dict[str, Any]] = None,
+                 slot_minutes: Optional[int] = None, business_hours: Optional[List[Dict[str, Any]]] = None,
+                 timings: bool = False, horizon: str = "single", max_workers: Optional[int] = None,
+                 predictions: Optional[Dict[str, int]] = None,
+                 carry_in_hours: Optional[Dict[str, float]] = None):
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver '{solver}', expected one of {', '.join(SOLVERS)}")
+        if horizon not in HORIZONS:
+            raise ValueError(f"Unknown horizon '{horizon}', expected one of {', '.join(HORIZONS)}")
+        with tracing("optimize", timings) as trace:
+            with trace.stage("parse"):
+                staff  = self._to_staff(staff_data)
+                shifts = self._to_shifts(schedule_data)
+                # Hours already worked in the first week, before this schedule. Never read from
+                # StaffMember.weekly_hours: that is scratch state every run overwrites
+                carry_in = {sid: float(h) for sid, h in (carry_in_hours or {}).items() if h}
+            with trace.stage("normalize_features"):
+                feats  = self._normalize_features(feature_lookup, schedule_data)
+            with trace.stage("predict"):
+                # Callers that already hold predictions (what-if scenarios) skip the model
+                preds  = self._predict(feats) if predictions is None else dict(predictions)
+            horizon_report = None
+            # Later stages count hours per ISO week too when planning week by week
+            weekly_carry = carry_in if horizon == "weekly" else None
+            with trace.stage("apply_optimization"):
+                if horizon == "weekly":
+                    optimized, changes, solver_report, horizon_report = self._apply_weekly(
+                        shifts, staff, preds, business_type, solver, solver_options, carry_in, max_workers)
+                elif solver == "optimal":
+                    optimized, changes, solver_report = self._apply_optimal(shifts, staff, preds, business_type, solver_options)
+                else:
+                    optimized, changes = self._apply_optimization(shifts, staff, preds, business_type)
+                    solver_report = {"solver": "greedy"}
+                trace.count_changes(changes)
+            search_report = None
+            if time_budget_ms and time_budget_ms > 0:
+                with trace.stage("local_search"):
+                    optimized, moved, search_report = self._local_search(optimized, staff, preds, business_type,
+                                                                         time_budget_ms, search_options, weekly_carry)
+                    trace.count("candidate_evaluations", search_report["iterations"])
+                    trace.count_changes(moved)
+                changes = changes + moved
+            coverage = None
+            if slot_minutes:
+                with trace.stage("cover_intraday"):
+                    optimized, covered, coverage = self._cover_intraday(optimized, staff, preds, feats, business_type,
+                                                                        int(slot_minutes), business_hours, weekly_carry)
+                    trace.count_changes(covered)
+                changes = changes + covered
+            with trace.stage("build_output"):
+                result = self._build_output(staff, shifts, optimized, preds, changes, business_type)
+            result["metadata"]["solver"] = solver_report
+            if horizon_report is not None:
+                result["metadata"]["horizon"] = horizon_report
+            if search_report is not None:
+                result["metadata"]["local_search"] = search_report
+            if coverage is not None:
+                for day in result["calendar"]["days"]:
+                    if day["date"] in coverage:
+                        day["coverage"] = coverage[day["date"]]
+            # Optional LLM-style post-process (non-ML). No external calls by default.
+            with trace.stage("llm_post_process"):
+                result = self._maybe_llm_post_process(result, business_type)
+            return self._attach_timings(trace, result, timings)
+
+    def update_schedule(self, staff_data, schedule_data, feature_lookup, update, business_type: Optional[str] = None,
+                        incremental: bool = False, predictions: Optional[Dict[str, int]] = None,
+                        timings: bool = False):
+        with tracing("update", timings) as trace:
+            with trace.stage("parse"):
+                staff  = self._to_staff(staff_data)
+                shifts = self._to_shifts(schedule_data)
+            if update.get("update_type") == "staff_unavailable":
+                staff = self._mark_unavailable(staff, update["staff_id"], update["date"])
+                if incremental:
+                    with trace.stage("update_incremental"):
+                        result = self._update_incremental(staff, shifts, feature_lookup, schedule_data, update,
+                                                          business_type, predictions or {})
+                        trace.count_changes(result["changes"])
+                    return self._attach_timings(trace, result, timings)
+            with trace.stage("normalize_features"):
+                feats  = self._normalize_features(feature_lookup, schedule_data)
+            with trace.stage("predict"):
+                preds  = self._predict(feats)
+            changes = []
+            if update.get("update_type") == "staff_unavailable":
+                with trace.stage("staff_unavailability"):
+                    shifts, extra = self._apply_staff_unavailability(
+                        update["date"], update["staff_id"], shifts, staff, business_type)
+                    trace.count_changes(extra)
+                with trace.stage("apply_optimization"):
+                    opt, ch = self._apply_optimization(shifts, staff, preds, business_type)
+                    trace.count_changes(ch)
+                # Replacements first, as they happened, so a trimmed replacement nets out
+                optimized, changes = opt, self._net_changes(extra + ch)
+            else:
+                with trace.stage("apply_optimization"):
+                    optimized, changes = self._apply_optimization(shifts, staff, preds, business_type)
+                    trace.count_changes(changes)
+            with trace.stage("build_output"):
+                result = self._build_output(staff, shifts, optimized, preds, changes, business_type)
+            with trace.stage("llm_post_process"):
+                result = self._maybe_llm_post_process(result, business_type)
+            return self._attach_timings(trace, result, timings)
+
+    @staticmethod
+    def _attach_timings(trace, result: Dict[str, Any], requested: bool) -> Dict[str, Any]:
+        if trace.enabled:
+            report = trace.finish()
+            if requested:
+                result.setdefault("metadata", {})["timings"] = report
         return result
 
-    def update_schedule(self, staff_data, schedule_data, feature_lookup, update, business_type: Optional[str] = None):
+    def optimize_stream(self, staff_data, schedule_data, feature_lookup, business_type: Optional[str] = None,
+                        **options) -> Iterator[Dict[str, Any]]:
+        """
+        optimize() as a sequence of records for NDJSON responses: one {"type": "day"}
+        per calendar day (the calendar day plus its "changes"), then one
+        {"type": "summary"} with summary, payroll, predictions, llm_suggestions and
+        metadata. flat_shifts is not repeated. With the plain greedy solver each day
+        is yielded as soon as _optimize_date() has finalized it, in optimization
+        order, so the full calendar is never held in memory. solver="optimal",
+        time_budget_ms, slot_minutes and horizon="weekly" need the whole schedule
+        first; those results are split into the same records after optimize() returns.
+        """
+        if (options.get("solver", "greedy") != "greedy" or options.get("time_budget_ms")
+                or options.get("slot_minutes") or options.get("horizon", "single") != "single"):
+            yield from self._split_result(self.optimize(staff_data, schedule_data, feature_lookup,
+                                                       business_type, **options))
+            return
         staff  = self._to_staff(staff_data)
         shifts = self._to_shifts(schedule_data)
         feats  = self._normalize_features(feature_lookup, schedule_data)
         preds  = self._predict(feats)
-        changes = []
-        if update.get("update_type") == "staff_unavailable":
-            shifts, extra = self._apply_staff_unavailability(
-                update["date"], update["staff_id"], shifts, staff, business_type)
-            opt, ch = self._apply_optimization(shifts, staff, preds, business_type)
-            optimized, changes = opt, ch + extra
+        for s in staff: s.weekly_hours = 0
+        state = ScheduleState(shifts, staff)
+        role_keep_pri = self._removal_priority_for_bt(business_type)
+        frontline = self._frontline_roles_for_bt(business_type)
+
+        pay: Dict[str, float] = {}
+        ledger: Dict[str, List[Any]] = {k: [] for k in PayrollLedger.ROW_COLUMNS}
+        suggestions: List[str] = []
+        total_cost, n_after = 0.0, 0
+
+        def day_record(d: str, changes: List[Dict[str, Any]]):
+            nonlocal total_cost, n_after
+            rows, cost = self._shift_rows(state.on_date(d), staff, pay)
+            total_cost += cost
+            n_after += len(rows)
+            for k, col in ledger.items():
+                col.extend(r[k] for r in rows)
+            day = self._day_record(d, rows, preds.get(d, 0), business_type)
+            msg = self._day_suggestion(day, frontline, role_keep_pri, business_type)
+            if msg:
+                suggestions.append(msg)
+            return {"type": "day", **day, "changes": changes}
+
+        demand = self._role_demand(preds, business_type)
+        for d, req in preds.items():
+            changes: List[Dict[str, Any]] = []
+            self._optimize_date(state, d, req, staff, business_type, changes, demand[d])
+            yield day_record(d, changes)
+        # Days that only have shifts (no features) are reported but not re-planned
+        for d in sorted({sh.date for sh in state.shifts()} - preds.keys()):
+            yield day_record(d, [])
+
+        yield {
+            "type": "summary",
+            "predictions": preds,
+            "summary": self._summary_block(staff, shifts, n_after, total_cost, preds),
+            "payroll": {k: round(v, 2) for k, v in pay.items()},
+            "payroll_breakdown": PayrollLedger.from_columns(staff, *ledger.values()).breakdown(),
+            "llm_suggestions": suggestions or [NO_SUGGESTIONS],
+            "metadata": {**self._metadata_block(staff, n_after, business_type), "solver": {"solver": "greedy"}},
+        }
+
+    @staticmethod
+    def _split_result(result: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """A full optimize() result as optimize_stream() records."""
+        by_date: Dict[str, List[Dict[str, Any]]] = {}
+        for c in result.get("changes", []):
+            by_date.setdefault(c.get("date"), []).append(c)
+        for day in result["calendar"]["days"]:
+            yield {"type": "day", **day, "changes": by_date.get(day["date"], [])}
+        yield {"type": "summary",
+               **{k: v for k, v in result.items() if k not in ("calendar", "flat_shifts", "changes")}}
+
+    def compare_scenarios(self, staff_data, schedule_data, feature_lookup, scenarios: List[Dict[str, Any]],
+                          business_type: Optional[str] = None, max_workers: Optional[int] = None,
+                          **options) -> Dict[str, Any]:
+        """
+        What-if sweep: optimize the base payload and every scenario, returning one
+        compact comparison row each (cost, hours, coverage, change counts) instead
+        of full schedules. Staff, shifts, features and the availability index are
+        parsed once and base predictions made once; a scenario only re-predicts
+        the dates its feature overrides touch. Scenario keys, all optional:
+          name           label in the table (default "scenario_<n>")
+          features       {feature: value} set on every date, e.g. {"diwali_flag": 1}
+          feature_lookup per-date overrides, same shapes as the request's feature_lookup
+          demand_scale   multiplies every predicted headcount, e.g. 1.2 for "demand +20%"
+          staff_leave    [staff_id, ...] off for the whole period, or {staff_id: [date, ...]}
+          business_type  and any of OPTIMIZE_OPTIONS, overriding the base payload
+        Variants are evaluated on a process pool (max_workers, default CPU count;
+        workers plan with the module-level engine's rules). A failing scenario
+        only turns its own row into an error.
+        """
+        if not scenarios:
+            raise ValueError("scenarios must be a non-empty list")
+        with tracing("scenarios") as trace:
+            with trace.stage("parse"):
+                staff  = self._to_staff(staff_data)
+                shifts = self._to_shifts(schedule_data)
+                staff.availability  # built once, shared by every variant
+            with trace.stage("normalize_features"):
+                feats  = self._normalize_features(feature_lookup, schedule_data)
+            with trace.stage("predict"):
+                preds  = self._predict(feats)
+                jobs = [("base", {}, feats, preds, business_type, options)]
+                for i, spec in enumerate(scenarios, 1):
+                    name = str(spec.get("name") or f"scenario_{i}") if isinstance(spec, dict) else f"scenario_{i}"
+                    try:
+                        jobs.append((name, *self._scenario_inputs(spec, staff, feats, preds, business_type, options)))
+                    except Exception as e:
+                        jobs.append((name, e))
+            with trace.stage("evaluate"):
+                rows = self._evaluate_scenarios(jobs, staff, shifts, max_workers)
+            base = rows[0]
+            for row in rows[1:]:
+                if "error" not in row and "error" not in base:
+                    row["cost_delta"] = round(row["total_cost"] - base["total_cost"], 2)
+                    row["coverage_delta"] = round(row["coverage"] - base["coverage"], 4)
+            result = {"base": base, "scenarios": rows[1:], "predictions": preds,
+                      "metadata": {"generated_at": datetime.now().isoformat(), "total_staff": len(staff),
+                                   "business_type": business_type or "general", "scenarios": len(rows) - 1}}
+            return self._attach_timings(trace, result, False)
+
+    def _scenario_inputs(self, spec: Dict[str, Any], staff: StaffRegistry, feats: Dict[str, Dict[str, Any]],
+                         preds: Dict[str, int], business_type: Optional[str], options: Dict[str, Any]):
+        """One scenario's overrides applied to the shared inputs → (leave, feats, preds, business_type, options)."""
+        if not isinstance(spec, dict):
+            raise ValueError("scenario must be an object")
+        everywhere = spec.get("features") or {}
+        per_date = self._normalize_features(spec.get("feature_lookup") or {}, [])
+        if everywhere or per_date:
+            feats = {d: {**f, **everywhere} for d, f in feats.items()}
+            for d, f in per_date.items():
+                feats[d] = {**feats.get(d, {}), **f}
+            # Only touched dates go back through the model (and mostly hit the prediction cache)
+            touched = set(per_date) | (set(feats) if everywhere else set())
+            preds = {**preds, **self._predict({d: feats[d] for d in touched})}
+        scale = spec.get("demand_scale")
+        if scale is not None:
+            preds = {d: max(0, round(v * float(scale))) for d, v in preds.items()}
+
+        leave = spec.get("staff_leave") or {}
+        if isinstance(leave, list):
+            leave = dict.fromkeys(leave, list(preds))
+        unknown = [sid for sid in leave if staff.get(sid) is None]
+        if unknown:
+            raise ValueError(f"Unknown staff_id in staff_leave: {', '.join(map(str, unknown))}")
+        leave = {sid: list(dates) for sid, dates in leave.items()}
+
+        opts = {**options, **{k: spec[k] for k in OPTIMIZE_OPTIONS if k in spec}}
+        return leave, feats, preds, spec.get("business_type", business_type), opts
+
+    def _evaluate_scenarios(self, jobs: List[tuple], staff: StaffRegistry, shifts: List[Shift],
+                            max_workers: Optional[int]) -> List[Dict[str, Any]]:
+        rows: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+        runnable = []
+        for i, job in enumerate(jobs):
+            if len(job) == 2:  # overrides did not resolve
+                rows[i] = {"name": job[0], "error": str(job[1])}
+            else:
+                runnable.append(i)
+        workers = max(1, min(int(max_workers or os.cpu_count() or 1), len(runnable)))
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            try:
+                futures = {i: pool.submit(_scenario_job, (staff, shifts, *jobs[i])) for i in runnable}
+                for i, fut in futures.items():
+                    try:
+                        rows[i] = fut.result()
+                    except Exception as e:
+                        rows[i] = {"name": jobs[i][0], "error": str(e)}
+            finally:
+                pool.shutdown()
         else:
-            optimized, changes = self._apply_optimization(shifts, staff, preds, business_type)
-        result = self._build_output(staff, shifts, optimized, preds, changes, business_type)
-        result = self._maybe_llm_post_process(result, business_type)
-        return result
+            for i in runnable:
+                rows[i] = self._run_scenario(staff, shifts, *jobs[i])
+        return rows
+
+    def _run_scenario(self, staff: StaffRegistry, shifts: List[Shift], name: str, leave: Dict[str, List[str]],
+                      feats: Dict[str, Dict[str, Any]], preds: Dict[str, int], business_type: Optional[str],
+                      options: Dict[str, Any]) -> Dict[str, Any]:
+        """Optimize one variant on private copies of the shared inputs (optimize() copies the shifts) → its comparison row."""
+        try:
+            result = self.optimize(staff.copy(leave), shifts, feats, business_type,
+                                   predictions=preds, **options)
+        except Exception as e:
+            logger.warning(f"Scenario {name} failed: {e}")
+            return {"name": name, "error": str(e)}
+        return self._scenario_row(name, result)
+
+    @staticmethod
+    def _scenario_row(name: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        days = result["calendar"]["days"]
+        required = sum(d["predicted_required"] for d in days)
+        covered = sum(min(d["actual_count"], d["predicted_required"]) for d in days)
+        changes = dict.fromkeys(_CHANGE_COUNTERS.values(), 0)
+        for c in result["changes"]:
+            key = _CHANGE_COUNTERS.get(c.get("type"))
+            if key:
+                changes[key] += 1
+        summary = result["summary"]
+        return {
+            "name": name,
+            "total_cost": summary["total_cost_after"],
+            "total_shifts": summary["total_shifts_after"],
+            "total_hours": round(sum(d["totals"]["hours"] for d in days), 2),
+            "required_shifts": required,
+            # Share of predicted headcount actually staffed, day by day (overstaffing does not count)
+            "coverage": round(covered / required, 4) if required else 1.0,
+            "understaffed_days": sum(d["status"] == "understaffed" for d in days),
+            "overstaffed_days": sum(d["status"] == "overstaffed" for d in days),
+            "changes": changes,
+            "business_type": result["metadata"]["business_type"],
+            "solver": result["metadata"]["solver"]["solver"],
+        }
+
+    @staticmethod
+    def _mark_unavailable(staff: StaffRegistry, staff_id: str, date: str) -> StaffRegistry:
+        """
+        staff with date added to staff_id's unavailable dates, keeping them out of
+        their own replacement. A copy: the caller's members and any availability
+        index already built for them are left as they were.
+        """
+        st = staff.get(staff_id)
+        if st is None or date in st.unavailable_dates:
+            return staff
+        return staff.copy({staff_id: [date]})
+
+    def _update_incremental(self, staff: StaffRegistry, shifts: List[Shift], feature_lookup, schedule_data,
+                            update: Dict[str, Any], business_type: Optional[str], predictions: Dict[str, int]):
+        """
+        Re-plan only the disrupted date and return a delta patch against the submitted
+        schedule. Predictions from the prior response are reused when supplied; the
+        model only runs for dates it has to re-plan. Days later in the same ISO week
+        are re-planned only if the replacement pushed someone past max_hours_per_week.
+        Dates without features are left as submitted, as the full path leaves them.
+        """
+        date = update["date"]
+        week = datetime.strptime(date, "%Y-%m-%d").isocalendar()[:2]
+        feats = self._normalize_features(feature_lookup, schedule_data)
+        preds: Dict[str, int] = {}
+
+        def required(d: str) -> Optional[int]:
+            # Like the full path, a date without features (or a prior prediction) is not re-planned
+            if d not in preds:
+                if d in predictions:
+                    preds[d] = int(predictions[d])
+                elif d in feats:
+                    preds[d] = self._predict({d: feats[d]})[d]
+                else:
+                    return None
+            return preds[d]
+
+        for s in staff: s.weekly_hours = 0
+        state = ScheduleState(shifts, staff)
+        changes: List[Dict[str, Any]] = []
+        replaced = self._replace_unavailable(state, date, update["staff_id"], staff, business_type, changes)
+        st = staff.get(update["staff_id"])
+        changes[:0] = [{"type":"REMOVED","date":date,
+                        "staff_id":sh.staff_id,"staff_name":st.name if st else "?",
+                        "shift_time":f"{sh.start_time}-{sh.end_time}",
+                        "role": sh.role,
+                        "reason":"Staff unavailable"} for sh in replaced]
+        req = required(date)
+        if req is not None:
+            self._optimize_date(state, date, req, staff, business_type, changes)
+
+        # Weekly-hours-coupled days: later optimizer shifts of anyone now over their limit
+        touched = {c["staff_id"] for c in changes if c["type"] == "ADDED"}
+        coupled = sorted(d for d in set(feats) | set(predictions)
+                         if d > date and datetime.strptime(d, "%Y-%m-%d").isocalendar()[:2] == week)
+        for d in coupled:
+            over = [sh for sh in state.on_date(d)
+                    if sh.staff_id in touched and sh.is_optimized and not sh.is_owner_created
+                    and staff.get(sh.staff_id).weekly_hours > staff.get(sh.staff_id).max_hours_per_week]
+            if not over:
+                continue
+            for sh in over:
+                state.remove(sh)
+                changes.append({"type":"REMOVED","date":d,
+                                "staff_id":sh.staff_id,"staff_name":staff.get(sh.staff_id).name,
+                                "shift_time":f"{sh.start_time}-{sh.end_time}",
+                                "role": sh.role,
+                                "reason":"Weekly hours exceeded after replacement"})
+            self._optimize_date(state, d, required(d), staff, business_type, changes)
+
+        changes = self._net_changes(changes)
+        before = {id(sh) for sh in shifts}
+        after = state.shifts()
+        after_ids = {id(sh) for sh in after}
+        removed = [sh for sh in shifts if id(sh) not in after_ids]
+        added = [sh for sh in after if id(sh) not in before]
+        touched_dates = sorted({date} | {sh.date for sh in removed} | {sh.date for sh in added})
+        added_agg = self._aggregate(added, staff, {}, business_type)
+        days = self._aggregate([sh for d in touched_dates for sh in state.on_date(d)], staff,
+                               {d: preds[d] for d in touched_dates if d in preds}, business_type)
+        cost_delta = added_agg["total_cost"] - sum(self._cost(sh, staff) for sh in removed)
+        return {
+            "incremental": True,
+            "patch": {
+                "removed": [{"shift_id": sh.shift_id, "date": sh.date, "staff_id": sh.staff_id,
+                             "start_time": sh.start_time, "end_time": sh.end_time, "role": sh.role}
+                            for sh in removed],
+                "added": added_agg["flat_shifts"],
+                "days": days["calendar"]["days"],
+            },
+            "changes": changes,
+            "predictions": preds,
+            "summary": {
+                "dates_replanned": touched_dates,
+                "shifts_removed": len(removed),
+                "shifts_added": len(added),
+                "cost_delta": round(cost_delta, 2),
+            },
+            "metadata": {
+                "generated_at": datetime.now().isoformat(),
+                "business_type": business_type or "general",
+            },
+        }
+
+    @staticmethod
+    def _net_changes(changes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Drop each REMOVED that undoes an earlier ADDED of the same shift, together with that ADDED."""
+        added: Dict[Tuple[str, str, str, str], List[int]] = {}
+        dropped = set()
+        for i, c in enumerate(changes):
+            key = (c["date"], c["staff_id"], c["shift_time"], c["role"])
+            if c["type"] == "ADDED":
+                added.setdefault(key, []).append(i)
+            elif c["type"] == "REMOVED" and added.get(key):
+                dropped.update((added[key].pop(), i))
+        return [c for i, c in enumerate(changes) if i not in dropped]
 
     # --- Converters
-    def _to_staff(self, raw):
-        out = []
-        for s in raw:
-            if isinstance(s, StaffMember):
-                out.append(s)
-            else:
-                # roles may be missing; default handled by dataclass
-                if "roles" not in s or s["roles"] is None:
-                    s = {**s, "roles": ["general"]}
-                out.append(StaffMember(**s))
-        return out
+    def _to_staff(self, raw) -> StaffRegistry:
+        if isinstance(raw, StaffRegistry):
+            return raw
+        return StaffRegistry([s if isinstance(s, StaffMember) else StaffMember.from_dict(s) for s in raw])
 
     def _to_shifts(self, raw):
+        """
+        Build Shift objects, parsing "HH:MM" times to minutes exactly once. Always
+        new instances: the caller's Shift objects are neither filled in nor held
+        by the run (or by the week plans and scenario runs built from it).
+        """
+        if isinstance(raw, ShiftStore):
+            return raw.to_shifts()
         out = []
         for s in raw:
-            if isinstance(s, Shift):
-                out.append(s)
-            else:
-                out.append(Shift(**s))
+            sh = replace(s) if isinstance(s, Shift) else Shift(**s)
+            if sh.start_min is None:
+                sh.start_min = parse_hhmm(sh.start_time)
+            if sh.end_min is None:
+                sh.end_min = parse_hhmm(sh.end_time)
+            out.append(sh)
         return out
 
+    @staticmethod
+    def _compile_templates(templates: Dict[str, Tuple[str, str]]) -> Dict[str, Tuple[int, int]]:
+        return {k: (parse_hhmm(st), parse_hhmm(et)) for k, (st, et) in templates.items()}
+
     # --- Feature Normalization
     def _normalize_features(self, features, schedule):
         """Return only dates that have either features or shifts."""
@@ -173,374 +1876,920 @@ class ScheduleEngine:
                 if isinstance(item, dict) and "date" in item:
                     feats = item.get("features") or {k:v for k,v in item.items() if k!="date"}
                     out[item["date"]] = feats
-        # include schedule dates only if they contain shifts
+        # include schedule dates only if they contain shifts; flat shift records
+        # (dicts, Shift objects, a ShiftStore) add no dates, as a date without
+        # features predicts 0 and would have all its shifts trimmed
+        if isinstance(schedule, ShiftStore):
+            return out
         for s in schedule:
+            if isinstance(s, Shift):
+                continue
             d = s.get("date")
             if d and s.get("shifts"):
                 out.setdefault(d, {})
         return out
 
     def _predict(self, features):
-        out = {}
-        for d,f in features.items():
-            df = pd.DataFrame([f])
-            for col in self.model_features:
-                if col not in df: df[col] = 0
-            try:
-                base = float(self.model.predict(df[self.model_features])[0])
-            except Exception:
-                base = 3
-            
-            # Apply day and holiday multipliers
-            dayname = datetime.strptime(d,"%Y-%m-%d").strftime("%A").lower()
-            if "saturday" in dayname or "sunday" in dayname: base *= 1.2
-            if f.get("diwali_flag") or f.get("christmas_flag"): base *= 1.5
-            
-            # Consider available staff count - don't predict more than available
-            available_staff = f.get("available_staff_count", 0)
-            total_staff = f.get("total_staff_count", 0)
-            
-            if available_staff > 0 and total_staff > 0:
-                # Cap prediction to available staff, but ensure at least 1 if staff exists
-                base = min(base, available_staff)
-                base = max(1, base)  # Ensure at least 1 if staff exists
-            elif total_staff > 0:
-                # If no available staff but total staff exists, predict minimum
-                base = 1
-            else:
-                # No staff at all
-                base = 0
-            
-            out[d] = max(0, int(round(base)))
-        return out
+        """Predict staff counts for every date in one batched model call."""
+        if not features:
+            return {}
+        dates = list(features.keys())
+        df = pd.DataFrame.from_records([features[d] for d in dates], index=dates)
+        # Columns in the order the model was fitted with, when it recorded them
+        names = getattr(self.model, "feature_names_in_", None)
+        X = df.reindex(columns=self.model_features if names is None else list(names), fill_value=0).fillna(0)
+        base = self._predict_base(X)
 
-    # --- Utilities
-    def _group_by_date(self, shifts):
-        g = {}
-        for s in shifts: g.setdefault(s.date, []).append(s)
-        return g
+        # Apply day and holiday multipliers
+        weekend = pd.to_datetime(pd.Index(dates), format="%Y-%m-%d").dayofweek.to_numpy() >= 5
+        base = np.where(weekend, base * WEEKEND_MULTIPLIER, base)
+        festive = np.logical_or.reduce([self._flag_column(df, f) for f in FESTIVE_FLAGS])
+        base = np.where(festive, base * FESTIVE_MULTIPLIER, base)
 
-    def _hours(self, s, e):
+        # Consider available staff count - don't predict more than available
+        available_staff = self._numeric_column(df, "available_staff_count")
+        total_staff = self._numeric_column(df, "total_staff_count")
+        # Cap prediction to available staff, but ensure at least 1 if staff exists;
+        # if no available staff but total staff exists, predict minimum; no staff at all → 0
+        base = np.where((available_staff > 0) & (total_staff > 0),
+                        np.maximum(1, np.minimum(base, available_staff)),
+                        np.where(total_staff > 0, 1, 0))
+
+        counts = np.maximum(0, np.rint(base)).astype(int)
+        return dict(zip(dates, counts.tolist()))
+
+    def _predict_base(self, X: pd.DataFrame) -> np.ndarray:
+        """Raw model output per row, served from the prediction cache where possible."""
+        model = self.model
         try:
-            s = datetime.strptime(s, "%H:%M"); e = datetime.strptime(e, "%H:%M")
-            return (e - s).seconds / 3600
-        except:
-            return 8
+            vectors = X.to_numpy(dtype=float)
+        except (TypeError, ValueError):
+            vectors = None
+        if vectors is None:
+            keys, cached = [], [None] * len(X)
+        else:
+            version = self.model_registry.version
+            keys = [PredictionCache.key(version, v) for v in vectors]
+            cached = self.prediction_cache.get_many(keys)
+        miss = [i for i, v in enumerate(cached) if v is None]
+        trace = current_trace()
+        trace.count("cache_hits", len(cached) - len(miss))
+        trace.count("cache_misses", len(miss))
+        base = np.array([3.0 if v is None else v for v in cached], dtype=float)
+        if miss:
+            try:
+                pred = np.asarray(model.predict(X.iloc[miss]), dtype=float).reshape(-1)
+            except Exception:
+                return base  # misses keep the fallback of 3 and are not cached
+            base[miss] = pred
+            if keys:
+                self.prediction_cache.put_many([(keys[i], float(v)) for i, v in zip(miss, pred)])
+        return base
+
+    @staticmethod
+    def _numeric_column(df, col):
+        if col not in df:
+            return np.zeros(len(df))
+        return pd.to_numeric(df[col], errors="coerce").fillna(0).to_numpy(dtype=float)
 
-    def _extend_time(self, end, add):
-        return (datetime.strptime(end, "%H:%M")+timedelta(hours=add)).strftime("%H:%M")
+    @staticmethod
+    def _flag_column(df, col):
+        if col not in df:
+            return np.zeros(len(df), dtype=bool)
+        return df[col].map(bool, na_action="ignore").fillna(False).to_numpy(dtype=bool)
 
-    def _cost(self, shift, staff):
-        s = next((x for x in staff if x.staff_id == shift.staff_id), None)
-        return 0 if not s else round(self._hours(shift.start_time, shift.end_time)*s.hourly_rate, 2)
+    # --- Utilities
+    def _cost(self, shift, staff: StaffRegistry):
+        s = staff.get(shift.staff_id)
+        return 0 if not s else round(shift.hours*s.hourly_rate, 2)
 
     # --- Business-type role mix rules (core of new behavior)
     def _role_mix(self, date: str, predicted: int, business_type: Optional[str], features: Dict[str, Any]) -> Dict[str, int]:
-        """
-        Returns role->required_count for the given date based on business_type.
-        Purely heuristic, non-ML, easy to extend.
-        """
-        dayname = datetime.strptime(date, "%Y-%m-%d").strftime("%A").lower()
-        weekend = 1 if dayname in ("saturday","sunday") else 0
-        diwali = 1 if features.get("diwali_flag") else 0
-
-        def cap_counts(mix: Dict[str, float]) -> Dict[str, int]:
-            # Normalize to integer counts and ensure sum ~ predicted
-            # Strategy: round, then adjust by adding/removing from largest roles
-            if predicted <= 0: return {}
-            ints = {r: max(0, int(round(c))) for r, c in mix.items()}
-            total = sum(ints.values())
-            if total == 0:
-                # fallback: at least 1 general
-                return {"general": predicted}
-            # adjust
-            if total < predicted:
-                # add to roles with biggest fractional need (use current ints as base)
-                need = predicted - total
-                for _ in range(need):
-                    # choose role with max current count (frontline bias)
-                    r = max(ints.keys(), key=lambda k: ints[k])
-                    ints[r] += 1
-            elif total > predicted:
-                extra = total - predicted
-                for _ in range(extra):
-                    # remove from role with max count but keep >=0
-                    r = max(ints.keys(), key=lambda k: ints[k])
-                    if ints[r] > 0:
-                        ints[r] -= 1
-            return ints
+        """Returns role->required_count for the given date based on business_type."""
+        return self.business_rules.get(business_type).demand([date], [predicted], {date: features})[date]
 
-        bt = (business_type or "general").lower()
+    def _role_demand(self, preds: Dict[str, int], business_type: Optional[str]) -> Dict[str, Dict[str, int]]:
+        """_role_mix for every predicted date in one vectorized step."""
+        return self.business_rules.get(business_type).demand(list(preds), list(preds.values()))
 
-        # Default generic retail split
-        mix = {
-            "cashier": 0.35 * predicted,
-            "floor_exec": 0.35 * predicted,
-            "picker": 0.15 * predicted,
-            "qc": 0.05 * predicted,
-            "delivery": 0.10 * predicted
-        }
+    # --- Staff selection fairness (role-aware)
+    def _select_staff_for_role(self, date: str, staff: StaffRegistry, count: int, role: str,
+                               state: Optional[ScheduleState] = None,
+                               place: Optional[Callable[[int, int], Tuple[int, int]]] = None) -> List[StaffMember]:
+        """
+        Pick count staff for role on date. With state, only people whose shift for
+        the role (their template, moved by place if given) overlaps none of their
+        shifts that day and keeps them within max_hours_per_day are considered.
+        """
+        if count <= 0:
+            return []
+        # Available on the date and able to work the role, with weekly hours left
+        avail = [s for _, s in staff.availability.members_of(staff.availability.candidates(date, role))
+                 if s.weekly_hours < s.max_hours_per_week]
+        current_trace().count("candidate_evaluations", len(avail))
+        # Fairness (lower total hours first), then cost (lower hourly rate)
+        if state is None:
+            return heapq.nsmallest(count, avail, key=lambda x:(x.weekly_hours, x.hourly_rate))
+        # Same order, checking the day's intervals only until count people fit
+        heap = [(s.weekly_hours, s.hourly_rate, i, s) for i, s in enumerate(avail)]
+        heapq.heapify(heap)
+        picked = []
+        while heap and len(picked) < count:
+            s = heapq.heappop(heap)[3]
+            if state.fits(s.staff_id, date, *self._placed(s, role, place), self.max_hours_per_day):
+                picked.append(s)
+        return picked
 
-        if bt in ("electronics","electronics_fragile","electronics-fragile","electronics_with_fragile","electronics (fragile)"):
-            # Electronics + fragile shipping → enforce packing fragile & QC presence
-            base = predicted
-            mix = {
-                "cashier": 0.25 * base,
-                "floor_exec": 0.25 * base,
-                "picker": 0.15 * base,
-                "packer_fragile": 0.20 * base,
-                "qc": 0.10 * base,
-                "delivery": 0.05 * base
-            }
-            if weekend:  # more footfall; push cashier/floor
-                mix["cashier"] += 0.05 * base
-                mix["floor_exec"] += 0.05 * base
-                # steal from picker/delivery to keep total similar
-                mix["picker"] -= 0.03 * base
-                mix["delivery"] -= 0.07 * base
-            if diwali:   # big-ticket festive sensitivity → more QC/fragile packing
-                mix["qc"] += 0.05 * base
-                mix["packer_fragile"] += 0.05 * base
-                mix["floor_exec"] -= 0.05 * base
-                mix["picker"] -= 0.05 * base
-
-        elif bt in ("grocery","supermarket"):
-            mix = {
-                "cashier": 0.30 * predicted,
-                "floor_exec": 0.30 * predicted,
-                "picker": 0.25 * predicted,
-                "delivery": 0.10 * predicted,
-                "qc": 0.05 * predicted
-            }
-            if weekend:
-                mix["cashier"] += 0.05 * predicted
-                mix["floor_exec"] += 0.05 * predicted
-                mix["picker"] -= 0.05 * predicted
-                mix["delivery"] -= 0.05 * predicted
-
-        elif bt in ("restaurant","cafe","qsr"):
-            mix = {
-                "cashier": 0.20 * predicted,
-                "floor_exec": 0.30 * predicted,  # servers
-                "picker": 0.00,
-                "delivery": 0.25 * predicted,
-                "qc": 0.05 * predicted,
-                "general": 0.20 * predicted      # kitchen/back
-            }
-
-        elif bt in ("pharmacy","chemists"):
-            mix = {
-                "cashier": 0.25 * predicted,
-                "floor_exec": 0.25 * predicted,
-                "picker": 0.20 * predicted,
-                "qc": 0.10 * predicted,
-                "delivery": 0.20 * predicted
-            }
-
-        elif bt in ("fashion","clothing","apparel"):
-            mix = {
-                "cashier": 0.30 * predicted,
-                "floor_exec": 0.50 * predicted,
-                "qc": 0.05 * predicted,
-                "picker": 0.00,
-                "delivery": 0.00,
-                "general": 0.15 * predicted
-            }
-            if weekend:
-                mix["floor_exec"] += 0.1 * predicted
-                mix["general"] -= 0.1 * predicted
-
-        # finalize to ints with sum close to predicted
-        return cap_counts({k: max(0.0, v) for k, v in mix.items()})
+    def _shift_template(self, staff: StaffMember, role: str) -> Tuple[int, int]:
+        # try role-specific template, then the staff member's preferred shift
+        tpl = self.role_shift_templates.get(role)
+        if not tpl and staff.preferred_shifts:
+            tpl = self.shift_templates.get(staff.preferred_shifts[0])
+        return tpl or self.default_shift
 
-    # --- Staff selection fairness (role-aware)
-    def _select_staff_for_role(self, date: str, staff: List[StaffMember], count: int, role: str) -> List[StaffMember]:
-        day = datetime.strptime(date, "%Y-%m-%d").strftime("%A").lower()
-        date_str = date
-        
-        avail = []
-        for s in staff:
-            # Check basic availability
-            is_available = True
-            
-            # Check unavailable days
-            if day in [d.lower() for d in s.unavailable_days]:
-                is_available = False
-            
-            # Check unavailable dates
-            if date_str in s.unavailable_dates:
-                is_available = False
-            
-            # Check weekly hours limit
-            if s.weekly_hours >= s.max_hours_per_week:
-                is_available = False
-            
-            # Check role compatibility
-            if not (role in s.roles or "general" in s.roles):
-                is_available = False
-            
-            if is_available:
-                avail.append(s)
-        
-        # Sort by fairness (lower total hours first) and cost (lower hourly rate)
-        avail.sort(key=lambda x:(x.weekly_hours, x.hourly_rate))
-        return avail[:max(0, count)]
-
-    def _new_shift_for_role(self, date: str, staff: StaffMember, role: str):
-        # try role-specific template
-        st, et = self.role_shift_templates.get(role, None) or \
-                 self.shift_templates.get(staff.preferred_shifts[0], None) if staff.preferred_shifts else None
-        if not st:
-            st, et = ("09:00","17:00")
+    def _placed(self, staff: StaffMember, role: str,
+                place: Optional[Callable[[int, int], Tuple[int, int]]] = None) -> Tuple[int, int]:
+        st, et = self._shift_template(staff, role)
+        return place(st, et) if place else (st, et)
+
+    def _new_shift_for_role(self, date: str, staff: StaffMember, role: str, state: ScheduleState):
+        st, et = self._shift_template(staff, role)
         return Shift(
-            shift_id=f"opt_{date}{staff.staff_id}{role}_{datetime.now().strftime('%H%M%S%f')[:6]}",
+            shift_id=state.new_shift_id(f"opt_{date}{staff.staff_id}{role}"),
             staff_id=staff.staff_id, date=date,
-            start_time=st, end_time=et, role=role,
-            is_owner_created=False, is_optimized=True
+            start_time=format_hhmm(st), end_time=format_hhmm(et), role=role,
+            is_owner_created=False, is_optimized=True,
+            start_min=st, end_min=et
         )
 
     # --- Optimization
-    def _apply_optimization(self, shifts: List[Shift], staff: List[StaffMember], preds: Dict[str, int], business_type: Optional[str]):
-        shifts = list(shifts)
+    def _apply_optimization(self, shifts: List[Shift], staff: StaffRegistry, preds: Dict[str, int], business_type: Optional[str],
+                            carry_in: Optional[Dict[str, float]] = None):
         changes = []
-        group = self._group_by_date(shifts)
-
-        # Reset weekly hours and recompute from current shifts
-        for s in staff: s.weekly_hours = 0
-        for sh in shifts:
-            stf = next((x for x in staff if x.staff_id == sh.staff_id), None)
-            if stf:
-                stf.weekly_hours += self._hours(sh.start_time, sh.end_time)
+        # Reset weekly hours (to hours worked before the schedule, if any); the state adds the shifts
+        for s in staff: s.weekly_hours = carry_in.get(s.staff_id, 0) if carry_in else 0
+        state = ScheduleState(shifts, staff)
 
         # For each date: enforce business-type role mix and predicted counts
+        demand = self._role_demand(preds, business_type)
         for d, req in preds.items():
-            cur = group.get(d, [])
-            # Count existing by role
-            role_counts: Dict[str, int] = {}
-            for sh in cur:
-                role_counts[sh.role] = role_counts.get(sh.role, 0) + 1
+            self._optimize_date(state, d, req, staff, business_type, changes, demand[d])
 
-            # Desired role mix for this date
+        return state.shifts(), changes
+
+    def _optimize_date(self, state: ScheduleState, d: str, req: int, staff: StaffRegistry,
+                       business_type: Optional[str], changes: List[Dict[str, Any]],
+                       desired: Optional[Dict[str, int]] = None):
+        # Desired role mix for this date
+        if desired is None:
             desired = self._role_mix(d, req, business_type, features={})
 
-            # 1) Add missing roles up to desired counts
-            for role, want in desired.items():
-                have = role_counts.get(role, 0)
-                need = want - have
-                if need > 0:
-                    for s in self._select_staff_for_role(d, staff, need, role):
-                        sh = self._new_shift_for_role(d, s, role)
-                        if self._hours(sh.start_time, sh.end_time) <= self.max_hours_per_day:
-                            shifts.append(sh)
-                            s.weekly_hours += self._hours(sh.start_time, sh.end_time)
-                            changes.append({"type":"ADDED","date":d,
-                                            "staff_id":s.staff_id,"staff_name":s.name,
-                                            "shift_time":f"{sh.start_time}-{sh.end_time}",
-                                            "role": role,
-                                            "reason":f"Meet business-type role mix ({business_type or 'general'})"})
-                # refresh group and role counts after additions
-                group = self._group_by_date(shifts)
-                role_counts = {}
-                for sh in group.get(d, []):
-                    role_counts[sh.role] = role_counts.get(sh.role, 0) + 1
-
-            # 2) If total is still under predicted (due to rounding), fill with frontline roles
-            cur_total = len(group.get(d, []))
-            if cur_total < req:
-                fill_roles = self._frontline_roles_for_bt(business_type)
-                deficit = req - cur_total
-                for role in fill_roles:
-                    if deficit <= 0: break
-                    add_now = min(deficit, 9999)
-                    assigned = False
-                    for s in self._select_staff_for_role(d, staff, add_now, role):
-                        sh = self._new_shift_for_role(d, s, role)
-                        if self._hours(sh.start_time, sh.end_time) <= self.max_hours_per_day:
-                            shifts.append(sh)
-                            s.weekly_hours += self._hours(sh.start_time, sh.end_time)
-                            changes.append({"type":"ADDED","date":d,
-                                            "staff_id":s.staff_id,"staff_name":s.name,
-                                            "shift_time":f"{sh.start_time}-{sh.end_time}",
-                                            "role": role,
-                                            "reason":"Fill remaining predicted requirement"})
-                            deficit -= 1
-                            assigned = True
-                    if assigned:
-                        group = self._group_by_date(shifts)
-
-            # 3) If overstaffed vs predicted, remove lowest-priority roles first (non-owner & higher cost)
-            cur = group.get(d, [])
-            total_after = len(cur)
-            if total_after > req:
-                excess = total_after - req
-                removal_priority = self._removal_priority_for_bt(business_type)
-                # score: (rolePriority, ownerPenalty, cost, hours) → higher score removed first
-                def role_pri(role): 
-                    return removal_priority.get(role, removal_priority.get("*", 50))
-                scored: List[Tuple[Tuple[int,int,float,float], Shift]] = []
-                for sh in cur:
-                    owner_pen = 0 if not sh.is_owner_created else 100
-                    cost = self._cost(sh, staff)
-                    hrs = self._hours(sh.start_time, sh.end_time)
-                    scored.append(((role_pri(sh.role), owner_pen, cost, hrs), sh))
-                for _, sh in sorted(scored, key=lambda x: x[0], reverse=True)[:excess]:
-                    shifts.remove(sh)
-                    st = next((x for x in staff if x.staff_id == sh.staff_id), None)
-                    if st: st.weekly_hours -= self._hours(sh.start_time, sh.end_time)
-                    changes.append({"type":"REMOVED","date":d,
-                                    "staff_id":sh.staff_id,
-                                    "staff_name":st.name if st else "?",
+        # 1) Add missing roles up to desired counts
+        for role, want in desired.items():
+            need = want - state.role_count(d, role)
+            if need > 0:
+                for s in self._select_staff_for_role(d, staff, need, role, state):
+                    sh = self._new_shift_for_role(d, s, role, state)
+                    state.add(sh)
+                    changes.append({"type":"ADDED","date":d,
+                                    "staff_id":s.staff_id,"staff_name":s.name,
+                                    "shift_time":f"{sh.start_time}-{sh.end_time}",
+                                    "role": role,
+                                    "reason":f"Meet business-type role mix ({business_type or 'general'})"})
+
+        # 2) If total is still under predicted (due to rounding), fill with frontline roles
+        cur_total = state.count(d)
+        if cur_total < req:
+            fill_roles = self._frontline_roles_for_bt(business_type)
+            deficit = req - cur_total
+            for role in fill_roles:
+                if deficit <= 0: break
+                add_now = min(deficit, 9999)
+                for s in self._select_staff_for_role(d, staff, add_now, role, state):
+                    sh = self._new_shift_for_role(d, s, role, state)
+                    state.add(sh)
+                    changes.append({"type":"ADDED","date":d,
+                                    "staff_id":s.staff_id,"staff_name":s.name,
                                     "shift_time":f"{sh.start_time}-{sh.end_time}",
-                                    "role": sh.role,
-                                    "reason":"Reduce overstaffing vs predicted"})
-                group = self._group_by_date(shifts)
+                                    "role": role,
+                                    "reason":"Fill remaining predicted requirement"})
+                    deficit -= 1
+
+        # 3) If overstaffed vs predicted, remove lowest-priority roles first
+        self._trim_overstaffing(state, d, req, staff, business_type, changes)
+
+    def _trim_overstaffing(self, state: ScheduleState, d: str, req: int, staff: StaffRegistry,
+                           business_type: Optional[str], changes: List[Dict[str, Any]]):
+        """Remove lowest-priority roles first (non-owner & higher cost) until d meets req."""
+        total_after = state.count(d)
+        if total_after > req:
+            excess = total_after - req
+            removal_priority = self._removal_priority_for_bt(business_type)
+            # score: (rolePriority, ownerPenalty, cost, hours) → higher score removed first
+            def role_pri(role): 
+                return removal_priority.get(role, removal_priority.get("*", 50))
+            scored: List[Tuple[Tuple[int,int,float,float], Shift]] = []
+            for sh in state.on_date(d):
+                owner_pen = 0 if not sh.is_owner_created else 100
+                cost = self._cost(sh, staff)
+                hrs = sh.hours
+                scored.append(((role_pri(sh.role), owner_pen, cost, hrs), sh))
+            for _, sh in sorted(scored, key=lambda x: x[0], reverse=True)[:excess]:
+                state.remove(sh)
+                st = staff.get(sh.staff_id)
+                changes.append({"type":"REMOVED","date":d,
+                                "staff_id":sh.staff_id,
+                                "staff_name":st.name if st else "?",
+                                "shift_time":f"{sh.start_time}-{sh.end_time}",
+                                "role": sh.role,
+                                "reason":"Reduce overstaffing vs predicted"})
+
+    # --- Rolling horizon (horizon="weekly")
+    def _apply_weekly(self, shifts: List[Shift], staff: StaffRegistry, preds: Dict[str, int],
+                      business_type: Optional[str], solver: str, solver_options: Optional[Dict[str, Any]],
+                      carry_in: Dict[str, float], max_workers: Optional[int] = None):
+        """
+        Plan each ISO week on its own so max_hours_per_week caps every week instead
+        of the whole request. The first week starts from carry_in (hours worked
+        before the schedule); later weeks start from their own shifts only. Given
+        its carry-in a week depends on nothing else, so weeks whose inputs are
+        unchanged come from week_plan_cache and the rest can run on a process pool
+        (max_workers > 1; workers plan with the module-level engine's rules).
+        Shifts in weeks without predictions pass through untouched.
+        Returns (shifts, changes, solver_report, horizon_report).
+        """
+        week_preds, week_shifts = self._by_week(preds, shifts)
+        weeks = sorted(week_preds)
+        staff_key = json.dumps([[getattr(m, f.name) for f in fields(m) if f.name != "weekly_hours"]
+                                for m in staff], default=str)
+
+        jobs, keys, plans = {}, {}, {}
+        for i, wk in enumerate(weeks):
+            carry = carry_in if i == 0 else {}
+            keys[wk] = hashlib.sha1(json.dumps([
+                staff_key, business_type, solver, solver_options, sorted(carry.items()),
+                list(week_preds[wk].items()),
+                [[sh.shift_id, sh.staff_id, sh.date, sh.start_time, sh.end_time, sh.role,
+                  sh.is_owner_created, sh.is_optimized] for sh in week_shifts.get(wk, [])],
+            ], sort_keys=True, default=str).encode()).hexdigest()
+            cached = self.week_plan_cache.get(keys[wk])
+            if cached is not None:
+                plans[wk] = cached
+            else:
+                jobs[wk] = (week_shifts.get(wk, []), week_preds[wk], carry)
+
+        workers = max(1, min(int(max_workers or 1), len(jobs)))
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            try:
+                futures = {wk: pool.submit(_plan_week_job, (sh, staff.members, pr, business_type,
+                                                            solver, solver_options, carry))
+                           for wk, (sh, pr, carry) in jobs.items()}
+                for wk, fut in futures.items():
+                    plans[wk] = fut.result()
+            finally:
+                pool.shutdown()
+        else:
+            for wk, (sh, pr, carry) in jobs.items():
+                plans[wk] = self._plan_week(sh, staff, pr, business_type, solver, solver_options, carry)
+        for wk in jobs:
+            self.week_plan_cache.put(keys[wk], plans[wk])
 
-        return shifts, changes
+        optimized = [sh for wk, group in week_shifts.items() if wk not in week_preds for sh in group]
+        changes: List[Dict[str, Any]] = []
+        reports = {}
+        for wk in weeks:
+            week_opt, week_changes, reports[wk] = plans[wk]
+            # Cached plans are shared: hand out copies the later stages may mutate
+            optimized += [replace(sh) for sh in week_opt]
+            changes += [dict(c) for c in week_changes]
+        for m in staff: m.weekly_hours = 0  # per-week totals are meaningless across the whole horizon
+        horizon_report = {"mode": "weekly", "weeks": weeks, "cached_weeks": len(weeks) - len(jobs),
+                          "workers": workers, "carry_in_staff": len(carry_in)}
+        solver_report = {"solver": solver, "weeks": reports} if solver == "optimal" else {"solver": "greedy"}
+        return optimized, changes, solver_report, horizon_report
+
+    @staticmethod
+    def _by_week(preds: Dict[str, int], shifts: List[Shift]):
+        """(ISO week → {date: prediction}, ISO week → shifts)."""
+        week_preds: Dict[str, Dict[str, int]] = {}
+        for d, req in preds.items():
+            week_preds.setdefault(_iso_week(d), {})[d] = req
+        week_shifts: Dict[str, List[Shift]] = {}
+        for sh in shifts:
+            week_shifts.setdefault(_iso_week(sh.date), []).append(sh)
+        return week_preds, week_shifts
+
+    def _plan_week(self, shifts: List[Shift], staff: StaffRegistry, preds: Dict[str, int],
+                   business_type: Optional[str], solver: str, solver_options: Optional[Dict[str, Any]],
+                   carry_in: Dict[str, float]):
+        """One week of _apply_weekly → (shifts, changes, solver_report)."""
+        if solver == "optimal":
+            return self._apply_optimal(shifts, staff, preds, business_type, solver_options, carry_in)
+        optimized, changes = self._apply_optimization(shifts, staff, preds, business_type, carry_in)
+        return optimized, changes, {"solver": "greedy"}
+
+    # --- Exact assignment (solver="optimal")
+    def _apply_optimal(self, shifts: List[Shift], staff: StaffRegistry, preds: Dict[str, int],
+                       business_type: Optional[str], options: Optional[Dict[str, Any]] = None,
+                       carry_in: Optional[Dict[str, float]] = None):
+        """
+        Fill the role demand of the whole horizon as one min-cost assignment
+        (staff × date × role MILP, solved with SciPy/HiGHS), then trim
+        overstaffed days like the greedy pass. Falls back to greedy when SciPy
+        is missing, the model exceeds max_variables or no feasible solution is
+        found within time_limit_ms.
+        """
+        opts = {**self.optimal_solver_defaults, **(options or {})}
+
+        def fallback(reason: str, **extra):
+            logger.info(f"Optimal solver fell back to greedy: {reason}")
+            optimized, changes = self._apply_optimization(shifts, staff, preds, business_type, carry_in)
+            return optimized, changes, {"solver": "greedy", "requested": "optimal",
+                                        "fallback_reason": reason, **extra}
+
+        try:
+            from scipy.optimize import milp, LinearConstraint, Bounds
+            from scipy.sparse import coo_matrix
+        except ImportError:
+            return fallback("scipy is not installed")
+
+        for s in staff: s.weekly_hours = carry_in.get(s.staff_id, 0) if carry_in else 0
+        state = ScheduleState(shifts, staff)
+        frontline = self._frontline_roles_for_bt(business_type)
+
+        # Demand slots (date, role, headcount); role None = frontline filler for rounding gaps
+        demand: List[Tuple[str, Optional[str], int]] = []
+        role_demand = self._role_demand(preds, business_type)
+        for d, req in preds.items():
+            missing = 0
+            for role, want in role_demand[d].items():
+                need = want - state.role_count(d, role)
+                if need > 0:
+                    demand.append((d, role, need))
+                    missing += need
+            fill = req - state.count(d) - missing
+            if fill > 0:
+                demand.append((d, None, fill))
+
+        # Candidate variables: one per (staff, demand slot) the person can legally work
+        members = staff.members
+        avail = staff.availability
+        frontline_mask = 0
+        for fr in frontline:
+            frontline_mask |= avail.eligible(fr)
+
+        cand: List[Tuple[int, int, str]] = []   # (staff index, slot index, role)
+        cost: List[float] = []
+        hours: List[float] = []
+        for j, (d, role, _) in enumerate(demand):
+            mask = avail.available(d) & (frontline_mask if role is None else avail.eligible(role))
+            for i, s in avail.members_of(mask):
+                if role is None:
+                    r = next(fr for fr in frontline if fr in s.roles or "general" in s.roles)
+                else:
+                    r = role
+                st, et = self._shift_template(s, r)
+                h = span_minutes(st, et) / 60
+                if not state.fits(s.staff_id, d, st, et, self.max_hours_per_day):
+                    continue
+                if h > s.max_hours_per_week - s.weekly_hours:
+                    continue
+                cand.append((i, j, r))
+                cost.append(h * s.hourly_rate)
+                hours.append(h)
+            if len(cand) > opts["max_variables"]:
+                return fallback("problem exceeds max_variables", variables=len(cand))
+
+        n, m = len(cand), len(demand)
+        changes: List[Dict[str, Any]] = []
+        if m == 0:
+            self._trim_all(state, preds, staff, business_type, changes)
+            return state.shifts(), changes, {"solver": "optimal", "status": "no demand", "optimal": True,
+                                             "solve_time_ms": 0.0, "optimality_gap": 0.0,
+                                             "variables": 0, "unfilled": 0}
+
+        # Unfilled headcount is penalised above the cost of any full assignment
+        penalty = (max(cost, default=0.0) + 1.0) * (sum(need for _, _, need in demand) + 1)
+        c = np.concatenate([np.asarray(cost, dtype=float), np.full(m, penalty)])
+        cols = np.arange(n)
+        slot_of = np.fromiter((j for _, j, _ in cand), dtype=int, count=n)
+        staff_of = np.fromiter((i for i, _, _ in cand), dtype=int, count=n)
+
+        # Each demand slot is filled exactly (assignments + unfilled slack)
+        fill_rows = np.concatenate([slot_of, np.arange(m)])
+        fill_cols = np.concatenate([cols, n + np.arange(m)])
+        A_fill = coo_matrix((np.ones(n + m), (fill_rows, fill_cols)), shape=(m, n + m))
+        need = np.array([need for _, _, need in demand], dtype=float)
+
+        # At most one new shift per staff member per day
+        day_key: Dict[Tuple[int, str], int] = {}
+        day_rows = np.fromiter((day_key.setdefault((i, demand[j][0]), len(day_key)) for i, j, _ in cand),
+                               dtype=int, count=n)
+        A_day = coo_matrix((np.ones(n), (day_rows, cols)), shape=(len(day_key), n + m))
+
+        # Weekly hours stay within max_hours_per_week
+        cap = np.array([max(0.0, s.max_hours_per_week - s.weekly_hours) for s in members])
+        A_week = coo_matrix((np.asarray(hours), (staff_of, cols)), shape=(len(members), n + m))
+
+        t0 = time.perf_counter()
+        res = milp(
+            c,
+            constraints=[LinearConstraint(A_fill.tocsr(), need, need),
+                         LinearConstraint(A_day.tocsr(), 0, 1),
+                         LinearConstraint(A_week.tocsr(), 0, cap)],
+            integrality=np.ones(n + m),
+            bounds=Bounds(np.zeros(n + m), np.concatenate([np.ones(n), need])),
+            options={"time_limit": opts["time_limit_ms"] / 1000.0,
+                     "mip_rel_gap": opts["mip_rel_gap"], "disp": False},
+        )
+        solve_ms = round((time.perf_counter() - t0) * 1000, 1)
+        if res.x is None:
+            return fallback(f"no feasible solution ({res.message})", solve_time_ms=solve_ms, variables=n)
+
+        chosen = np.flatnonzero(res.x[:n] > 0.5)
+        for k in chosen:
+            i, j, r = cand[k]
+            d, role, _ = demand[j]
+            s = members[i]
+            sh = self._new_shift_for_role(d, s, r, state)
+            state.add(sh)
+            changes.append({"type":"ADDED","date":d,
+                            "staff_id":s.staff_id,"staff_name":s.name,
+                            "shift_time":f"{sh.start_time}-{sh.end_time}",
+                            "role": r,
+                            "reason":(f"Meet business-type role mix ({business_type or 'general'})" if role
+                                      else "Fill remaining predicted requirement")})
+        self._trim_all(state, preds, staff, business_type, changes)
+
+        gap = getattr(res, "mip_gap", None)
+        return state.shifts(), changes, {
+            "solver": "optimal",
+            "status": res.message,
+            "optimal": res.status == 0,
+            "solve_time_ms": solve_ms,
+            "optimality_gap": None if gap is None else float(gap),
+            "objective": round(float(np.dot(res.x[:n] > 0.5, cost)), 2),
+            "variables": n,
+            "unfilled": int(round(res.x[n:].sum())),
+        }
+
+    def _trim_all(self, state: ScheduleState, preds: Dict[str, int], staff: StaffRegistry,
+                  business_type: Optional[str], changes: List[Dict[str, Any]]):
+        for d, req in preds.items():
+            self._trim_overstaffing(state, d, req, staff, business_type, changes)
+
+    # --- Local search (anytime improvement over the greedy/optimal schedule)
+    def _local_search(self, shifts: List[Shift], staff: StaffRegistry, preds: Dict[str, int],
+                      business_type: Optional[str], time_budget_ms: float,
+                      options: Optional[Dict[str, Any]] = None,
+                      carry_in: Optional[Dict[str, float]] = None):
+        """
+        Simulated annealing over optimizer-created shifts (owner shifts stay put).
+        Neighbourhoods: replace a shift's staff, swap staff between two shifts,
+        re-role a shift towards the desired role mix. Minimises
+        cost_weight·payroll + mix_weight·|role mix deviation| + spread_weight·var(weekly hours),
+        and returns the best schedule seen when time_budget_ms expires.
+        With carry_in (horizon="weekly") hours are kept per ISO week, the first
+        week starting from carry_in, so max_hours_per_week caps every week.
+        Reassigned shifts are copies; returns (shifts, changes, report).
+        """
+        opts = {**self.local_search_defaults, **(options or {})}
+        w_cost, w_mix, w_spread = opts["cost_weight"], opts["mix_weight"], opts["spread_weight"]
+        rng = random.Random(opts["seed"])
+        t0 = time.perf_counter()
+        deadline = t0 + time_budget_ms / 1000.0
+
+        members = staff.members
+        idx = {s.staff_id: i for i, s in reversed(list(enumerate(members)))}
+        n_staff = len(members)
+        pos = [p for p, sh in enumerate(shifts)
+               if sh.is_optimized and not sh.is_owner_created and sh.staff_id in idx]
+        movable = [shifts[p] for p in pos]
+        if not movable or not n_staff:
+            return shifts, [], {"iterations": 0, "accepted": 0, "elapsed_ms": 0.0, "reassigned": 0}
+
+        avail = staff.availability
+        desired = self._role_demand(preds, business_type)
+
+        # Hours per staff member, or per (staff member, ISO week): cell i·n_weeks + week_of[date]
+        if carry_in is None:
+            week_of = {sh.date: 0 for sh in shifts}
+        else:
+            dates = {*preds, *(sh.date for sh in shifts)}
+            weeks = sorted({_iso_week(d) for d in dates})
+            week_of = {d: weeks.index(_iso_week(d)) for d in dates}
+        n_weeks = max(week_of.values(), default=0) + 1
+
+        # Incremental objective components
+        hours = [0.0] * (n_staff * n_weeks)
+        if carry_in and preds:
+            first = week_of[min(preds)]
+            for sid, h in carry_in.items():
+                if sid in idx:
+                    hours[idx[sid] * n_weeks + first] += h
+        on_day: Dict[Tuple[int, str], int] = {}
+        role_cnt: Dict[Tuple[str, str], int] = {}
+        for sh in shifts:
+            i = idx.get(sh.staff_id)
+            if i is not None:
+                hours[i * n_weeks + week_of[sh.date]] += sh.hours
+                on_day[(i, sh.date)] = on_day.get((i, sh.date), 0) + 1
+            role_cnt[(sh.date, sh.role)] = role_cnt.get((sh.date, sh.role), 0) + 1
+        s1 = sum(hours); s2 = sum(h * h for h in hours)
+
+        def spread(a, b):
+            return b / len(hours) - (a / len(hours)) ** 2
+
+        def mix_dev(d, r, cnt):
+            return abs(cnt - desired.get(d, {}).get(r, 0)) if d in desired else 0
+
+        def can_work(i, sh, role, extra_h):
+            s = members[i]
+            return ((avail.candidates(sh.date, role) >> i) & 1
+                    and hours[i * n_weeks + week_of[sh.date]] + extra_h <= s.max_hours_per_week)
+
+        # Assignment per movable shift: (staff index, role, start_min, end_min)
+        assign = [(idx[sh.staff_id], sh.role, sh.start_min, sh.end_min) for sh in movable]
+        original = list(assign)
+
+        def shift_cost(i, st, et):
+            return span_minutes(st, et) / 60 * members[i].hourly_rate
+
+        def apply(k, i, role, st, et):
+            nonlocal s1, s2
+            sh = movable[k]
+            oi, orole, ost, oet = assign[k]
+            oh, nh = span_minutes(ost, oet) / 60, span_minutes(st, et) / 60
+            w = week_of[sh.date]
+            for j, dh in ((oi * n_weeks + w, -oh), (i * n_weeks + w, nh)):
+                s2 += (hours[j] + dh) ** 2 - hours[j] ** 2
+                s1 += dh
+                hours[j] += dh
+            on_day[(oi, sh.date)] -= 1
+            on_day[(i, sh.date)] = on_day.get((i, sh.date), 0) + 1
+            role_cnt[(sh.date, orole)] -= 1
+            role_cnt[(sh.date, role)] = role_cnt.get((sh.date, role), 0) + 1
+            assign[k] = (i, role, st, et)
+
+        def delta(k, i, role):
+            """Objective delta of giving movable[k] to staff i as role (None if infeasible)."""
+            sh = movable[k]
+            oi, orole, ost, oet = assign[k]
+            st, et = self._shift_template(members[i], role)
+            nh, oh = span_minutes(st, et) / 60, span_minutes(ost, oet) / 60
+            if nh > self.max_hours_per_day:
+                return None
+            if i != oi and (on_day.get((i, sh.date), 0) or not can_work(i, sh, role, nh)):
+                return None
+            if i == oi and not (role in members[i].roles or "general" in members[i].roles):
+                return None
+            d_cost = shift_cost(i, st, et) - shift_cost(oi, ost, oet)
+            d_mix = 0
+            if role != orole:
+                c_old, c_new = role_cnt.get((sh.date, orole), 0), role_cnt.get((sh.date, role), 0)
+                d_mix = (mix_dev(sh.date, orole, c_old - 1) - mix_dev(sh.date, orole, c_old)
+                         + mix_dev(sh.date, role, c_new + 1) - mix_dev(sh.date, role, c_new))
+            w = week_of[sh.date]
+            h = {oi * n_weeks + w: hours[oi * n_weeks + w] - oh}
+            h[i * n_weeks + w] = h.get(i * n_weeks + w, hours[i * n_weeks + w]) + nh
+            n1 = s1 - oh + nh
+            n2 = s2 + sum(v * v - hours[j] ** 2 for j, v in h.items())
+            d_spread = spread(n1, n2) - spread(s1, s2)
+            return w_cost * d_cost + w_mix * d_mix + w_spread * d_spread, st, et
+
+        def objective():
+            cost = sum(shift_cost(i, st, et) for i, _, st, et in assign)
+            mix = sum(mix_dev(d, r, c) for (d, r), c in role_cnt.items())
+            mix += sum(w for d, m in desired.items() for r, w in m.items() if (d, r) not in role_cnt)
+            return w_cost * cost + w_mix * mix + w_spread * spread(s1, s2)
+
+        current = initial = objective()
+        best, best_assign = current, list(assign)
+        temp0 = max(1.0, sum(shift_cost(i, st, et) for i, _, st, et in assign) / len(assign) * 0.1)
+        iterations = accepted = 0
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            temp = temp0 * max(1e-3, (deadline - now) / (deadline - t0))
+            iterations += 1
+            k = rng.randrange(len(movable))
+            move = rng.random()
+            if move < 0.5:
+                # replace: hand the shift to another staff member
+                cand = [(k, rng.randrange(n_staff), assign[k][1])]
+            elif move < 0.8:
+                # swap staff between two shifts on different dates
+                k2 = rng.randrange(len(movable))
+                if k2 == k or movable[k2].date == movable[k].date or assign[k][0] == assign[k2][0]:
+                    continue
+                cand = [(k, assign[k2][0], assign[k][1]), (k2, assign[k][0], assign[k2][1])]
+            else:
+                # re-role: move the shift towards an under-covered role on its date
+                d = movable[k].date
+                short = [r for r, want in desired.get(d, {}).items() if role_cnt.get((d, r), 0) < want]
+                if not short:
+                    continue
+                cand = [(k, assign[k][0], rng.choice(short))]
+
+            undo = [(ck, *assign[ck]) for ck, _, _ in cand]
+            total, ok = 0.0, True
+            for ck, ci, crole in cand:
+                res = delta(ck, ci, crole)
+                if res is None:
+                    ok = False
+                    break
+                total += res[0]
+                apply(ck, ci, crole, res[1], res[2])
+            if ok and (total <= 0 or rng.random() < math.exp(-total / temp)):
+                accepted += 1
+                current += total
+                if current < best - 1e-9:
+                    best, best_assign = current, list(assign)
+            else:
+                for ck, ci, crole, cst, cet in reversed(undo):
+                    apply(ck, ci, crole, cst, cet)
+
+        # Materialise the best assignment on copies and log reassignments
+        out = list(shifts)
+        changes = []
+        for k, old in enumerate(movable):
+            i, role, st, et = best_assign[k]
+            if best_assign[k] == original[k]:
+                continue
+            sh = replace(old, staff_id=members[i].staff_id, role=role, start_min=st, end_min=et,
+                         start_time=format_hhmm(st), end_time=format_hhmm(et))
+            out[pos[k]] = sh
+            changes.append({"type":"REASSIGNED","date":sh.date,
+                            "staff_id":sh.staff_id,"staff_name":members[i].name,
+                            "previous_staff_id":old.staff_id,
+                            "shift_time":f"{sh.start_time}-{sh.end_time}",
+                            "role": role,
+                            "reason":"Local search improvement (cost / role mix / fairness)"})
+        return out, changes, {
+            "iterations": iterations,
+            "accepted": accepted,
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+            "initial_objective": round(initial, 2),
+            "best_objective": round(best, 2),
+            "reassigned": len(changes),
+        }
+
+    # --- Intra-day coverage (slot_minutes set)
+    def _cover_intraday(self, shifts: List[Shift], staff: StaffRegistry, preds: Dict[str, int],
+                        feats: Dict[str, Dict[str, Any]], business_type: Optional[str], slot: int,
+                        business_hours: Optional[List[Dict[str, Any]]] = None,
+                        carry_in: Optional[Dict[str, float]] = None):
+        """
+        Spread each day's predicted headcount into per-slot demand over business
+        hours, measure coverage with a sweep line over shift intervals, then close
+        gaps left to right: first by sliding an optimizer shift whose whole span is
+        over-covered (if it still fits the person's day), otherwise by adding a
+        frontline shift at the gap. Each gap rescans all of the day's shifts, so a
+        day costs O(slots·shifts·span) at worst. With carry_in (horizon="weekly") each ISO
+        week gets its own state, the first starting from carry_in, so added shifts
+        respect max_hours_per_week in every week. Returns (shifts, changes, coverage_by_date).
+        """
+        if slot <= 0 or MINUTES_PER_DAY % slot:
+            raise ValueError("slot_minutes must be a positive divisor of 1440")
+        if carry_in is None:
+            groups, out = [(shifts, preds, {})], []
+        else:
+            week_preds, week_shifts = self._by_week(preds, shifts)
+            weeks = sorted(week_preds)
+            groups = [(week_shifts.get(wk, []), week_preds[wk], carry_in if i == 0 else {})
+                      for i, wk in enumerate(weeks)]
+            out = [sh for wk, group in week_shifts.items() if wk not in week_preds for sh in group]
+        hours_by_day = self._business_hours_by_weekday(business_hours)
+        frontline = self._frontline_roles_for_bt(business_type)
+        changes: List[Dict[str, Any]] = []
+        coverage: Dict[str, Dict[str, Any]] = {}
+
+        for group, group_preds, carry in groups:
+            for s in staff: s.weekly_hours = carry.get(s.staff_id, 0)
+            state = ScheduleState(group, staff)
+            for d in sorted(group_preds):
+                window = hours_by_day[datetime.strptime(d, "%Y-%m-%d").weekday()]
+                if window is None or preds[d] <= 0:
+                    continue
+                cov = self._cover_day(state, staff, d, preds[d], feats.get(d, {}), business_type,
+                                      window, slot, frontline, changes)
+                if cov is not None:
+                    coverage[d] = cov
+            out += state.shifts()
+        return out, changes, coverage
+
+    def _cover_day(self, state: ScheduleState, staff: StaffRegistry, d: str, req: int, feats: Dict[str, Any],
+                   business_type: Optional[str], window: Tuple[int, int], slot: int, frontline: List[str],
+                   changes: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """_cover_intraday for one open day → its coverage report (None without whole slots)."""
+        open_m, close_m = window
+        n = (close_m - open_m) // slot
+        if n <= 0:
+            return None
+        demand = self._slot_demand(req, feats, business_type, open_m, n, slot)
+        cov = self._sweep_coverage(state.on_date(d), open_m, n, slot)
+
+        k = 0
+        while k < n:
+            if cov[k] >= demand[k]:
+                k += 1
+                continue
+            start = open_m + k * slot
+            moved = False
+            for sh in state.on_date(d):
+                if not sh.is_optimized or sh.is_owner_created or sh.minutes is None:
+                    continue
+                a, b = self._slot_span(sh.start_min, sh.minutes, open_m, n, slot)
+                if a <= k < b or a >= b or np.any(cov[a:b] - demand[a:b] < 1):
+                    continue
+                new_start = max(open_m, min(start, close_m - sh.minutes))
+                # Checked against the person's other shifts that day, without the one being moved
+                state.remove(sh)
+                if not state.fits(sh.staff_id, d, new_start, (new_start + sh.minutes) % MINUTES_PER_DAY,
+                                  self.max_hours_per_day):
+                    state.add(sh)
+                    continue
+                cov[a:b] -= 1
+                old = f"{sh.start_time}-{sh.end_time}"
+                sh = self._retime(sh, new_start, sh.minutes)   # the moved copy replaces it
+                state.add(sh)
+                a, b = self._slot_span(sh.start_min, sh.minutes, open_m, n, slot)
+                cov[a:b] += 1
+                changes.append({"type":"ADJUSTED","date":d,
+                                "staff_id":sh.staff_id,"staff_name":staff.get(sh.staff_id).name,
+                                "shift_time":f"{sh.start_time}-{sh.end_time}",
+                                "previous_shift_time": old,
+                                "role": sh.role,
+                                "reason":f"Cover intra-day demand gap at {format_hhmm(start)}"})
+                moved = True
+                break
+            if moved:
+                continue
+            added = None
+
+            def at_gap(st, et):
+                length = min(span_minutes(st, et), close_m - open_m)
+                begin = max(open_m, min(start, close_m - length))
+                return begin, (begin + length) % MINUTES_PER_DAY
+
+            for role in frontline:
+                pick = self._select_staff_for_role(d, staff, 1, role, state, at_gap)
+                if pick:
+                    added = self._new_shift_for_role(d, pick[0], role, state)
+                    begin, _ = at_gap(added.start_min, added.end_min)
+                    added = self._retime(added, begin, min(added.minutes, close_m - open_m))
+                    break
+            if added is None:
+                k += 1   # nobody left to cover this slot; report it as a gap
+                continue
+            state.add(added)
+            a, b = self._slot_span(added.start_min, added.minutes, open_m, n, slot)
+            cov[a:b] += 1
+            changes.append({"type":"ADDED","date":d,
+                            "staff_id":added.staff_id,"staff_name":staff.get(added.staff_id).name,
+                            "shift_time":f"{added.start_time}-{added.end_time}",
+                            "role": added.role,
+                            "reason":f"Cover intra-day demand gap at {format_hhmm(start)}"})
+
+        gaps = demand - cov
+        return {
+            "slot_minutes": slot,
+            "open": format_hhmm(open_m),
+            "close": format_hhmm(close_m),
+            "demand": demand.tolist(),
+            "covered": cov.tolist(),
+            "understaffed_slots": int(np.count_nonzero(gaps > 0)),
+            "peak_demand": int(demand.max()),
+        }
+
+    def _business_hours_by_weekday(self, business_hours) -> List[Optional[Tuple[int, int]]]:
+        """Monday-first (open, close) minutes per weekday; None when closed."""
+        out: List[Optional[Tuple[int, int]]] = [self.default_business_hours] * 7
+        for row in business_hours or []:
+            day = row.get("day_of_week")
+            if isinstance(day, str):
+                day = WEEKDAYS.index(day.lower()) if day.lower() in WEEKDAYS else None
+            if not isinstance(day, int) or not 0 <= day < 7:
+                continue
+            if row.get("is_closed"):
+                out[day] = None
+                continue
+            o, c = parse_hhmm(row.get("open_time")), parse_hhmm(row.get("close_time"))
+            if o is not None and c is not None and c > o:
+                out[day] = (o, c)
+        return out
+
+    def _slot_demand(self, req: int, feats: Dict[str, Any], business_type: Optional[str],
+                     open_m: int, n: int, slot: int) -> np.ndarray:
+        """Headcount per slot: explicit feats["hourly_demand"], else req spread over the profile."""
+        hour_of_slot = (open_m + np.arange(n) * slot) // 60
+        hourly = self._hourly_demand(feats.get("hourly_demand"))
+        if hourly is not None:
+            return np.maximum(0, np.rint(hourly[hour_of_slot])).astype(int)
+        weights = np.asarray(self._intraday_profile(business_type), dtype=float)[hour_of_slot]
+        # Same staff-hours as req default-length shifts, shaped by the profile
+        shift_len = span_minutes(*self.default_shift)
+        curve = req * shift_len / slot * weights / weights.sum()
+        return np.clip(np.rint(curve), 1, req).astype(int)
+
+    @staticmethod
+    def _hourly_demand(explicit: Any) -> Optional[np.ndarray]:
+        """
+        feats["hourly_demand"] as 24 hourly headcounts: {"HH:MM" | hour: count}
+        or a list starting at midnight (repeated to 24). Malformed keys and
+        counts are skipped; None when nothing usable is left.
+        """
+        def count(v):
+            try:
+                v = float(v)
+            except (TypeError, ValueError):
+                return None
+            return v if math.isfinite(v) else None
+
+        hourly = np.zeros(24)
+        if isinstance(explicit, dict):
+            used = 0
+            for h, v in explicit.items():
+                if isinstance(h, str) and ":" in h:
+                    m = parse_hhmm(h)
+                    hh = None if m is None else m // 60
+                else:
+                    try:
+                        hh = int(h)
+                    except (TypeError, ValueError):
+                        hh = None
+                v = count(v)
+                if hh is None or not 0 <= hh < 24 or v is None:
+                    continue
+                hourly[hh] = v
+                used += 1
+            return hourly if used else None
+        if isinstance(explicit, (list, tuple)) and explicit:
+            values = [count(v) for v in explicit]
+            if all(v is None for v in values):
+                return None
+            return np.resize(np.array([v or 0.0 for v in values]), 24)
+        return None
+
+    @staticmethod
+    def _slot_span(start_m: int, minutes: int, open_m: int, n: int, slot: int) -> Tuple[int, int]:
+        """Slots fully covered by [start, start+minutes)."""
+        a = -(-(start_m - open_m) // slot)
+        b = (start_m + minutes - open_m) // slot
+        return max(0, a), min(n, b)
+
+    def _sweep_coverage(self, shifts: List[Shift], open_m: int, n: int, slot: int) -> np.ndarray:
+        diff = np.zeros(n + 1, dtype=int)
+        for sh in shifts:
+            if sh.minutes is None:
+                continue
+            a, b = self._slot_span(sh.start_min, sh.minutes, open_m, n, slot)
+            if a < b:
+                diff[a] += 1
+                diff[b] -= 1
+        return np.cumsum(diff[:-1])
+
+    @staticmethod
+    def _retime(sh: Shift, start_m: int, minutes: int) -> Shift:
+        """Copy of sh starting at start_m and lasting minutes; sh itself is left as submitted."""
+        end_m = (start_m + minutes) % MINUTES_PER_DAY
+        return replace(sh, start_min=start_m, end_min=end_m,
+                       start_time=format_hhmm(start_m), end_time=format_hhmm(end_m))
+
+    def _intraday_profile(self, business_type: Optional[str]) -> List[float]:
+        """Relative demand per hour of day (index 0-23) for the business type."""
+        return self.business_rules.get(business_type).intraday_profile
 
     def _frontline_roles_for_bt(self, business_type: Optional[str]) -> List[str]:
-        bt = (business_type or "general").lower()
-        if bt.startswith("electronics"):
-            return ["cashier","floor_exec","packer_fragile","qc","picker","delivery","general"]
-        if bt in ("grocery","supermarket"):
-            return ["cashier","floor_exec","picker","delivery","qc","general"]
-        if bt in ("restaurant","cafe","qsr"):
-            return ["floor_exec","cashier","delivery","general","qc"]
-        if bt in ("pharmacy","chemists"):
-            return ["cashier","picker","delivery","floor_exec","qc","general"]
-        if bt in ("fashion","clothing","apparel"):
-            return ["floor_exec","cashier","general","qc"]
-        return ["cashier","floor_exec","general","picker","qc","delivery"]
+        return self.business_rules.get(business_type).frontline
 
     def _removal_priority_for_bt(self, business_type: Optional[str]) -> Dict[str, int]:
         """
         Lower number = more critical (keep), higher = easier to remove first.
         """
-        bt = (business_type or "general").lower()
-        if bt.startswith("electronics"):
-            return {"cashier": 5, "floor_exec": 10, "packer_fragile": 5, "qc": 8, "picker": 12, "delivery": 15, "general": 20, "*": 50}
-        if bt in ("grocery","supermarket"):
-            return {"cashier": 5, "floor_exec": 8, "picker": 10, "delivery": 12, "qc": 15, "general": 20, "*": 50}
-        if bt in ("restaurant","cafe","qsr"):
-            return {"floor_exec": 5, "cashier": 8, "delivery": 10, "general": 12, "qc": 20, "*": 50}
-        if bt in ("pharmacy","chemists"):
-            return {"cashier": 5, "picker": 8, "delivery": 10, "floor_exec": 12, "qc": 15, "general": 20, "*": 50}
-        if bt in ("fashion","clothing","apparel"):
-            return {"floor_exec": 5, "cashier": 8, "general": 12, "qc": 20, "*": 50}
-        return {"cashier": 5, "floor_exec": 8, "general": 12, "picker": 15, "qc": 18, "delivery": 20, "*": 50}
-
-    def _apply_staff_unavailability(self, date, staff_id, shifts, staff, business_type):
-        removed = [sh for sh in shifts if sh.date == date and sh.staff_id == staff_id]
-        for sh in removed: shifts.remove(sh)
+        return self.business_rules.get(business_type).removal_priority
+
+    def _apply_staff_unavailability(self, date, staff_id, shifts, staff: StaffRegistry, business_type):
+        for s in staff: s.weekly_hours = 0
+        state = ScheduleState(shifts, staff)
         changes = []
+        self._replace_unavailable(state, date, staff_id, staff, business_type, changes)
+        return state.shifts(), changes
+
+    def _replace_unavailable(self, state: ScheduleState, date: str, staff_id: str, staff: StaffRegistry,
+                             business_type: Optional[str], changes: List[Dict[str, Any]]):
+        removed = [sh for sh in state.on_date(date) if sh.staff_id == staff_id]
+        for sh in removed: state.remove(sh)
         # Try to replace like-for-like role first
         for sh in removed:
             role = sh.role
-            candidates = self._select_staff_for_role(date, staff, 1, role)
+            candidates = self._select_staff_for_role(date, staff, 1, role, state)
             if candidates:
                 s = candidates[0]
-                new = self._new_shift_for_role(date, s, role)
-                shifts.append(new)
-                s.weekly_hours += self._hours(new.start_time, new.end_time)
+                new = self._new_shift_for_role(date, s, role, state)
+                state.add(new)
                 changes.append({
                     "type":"ADDED","date":date,
                     "staff_id":s.staff_id,"staff_name":s.name,
@@ -551,12 +2800,11 @@ class ScheduleEngine:
             else:
                 # fallback any frontline
                 for r in self._frontline_roles_for_bt(business_type):
-                    alt = self._select_staff_for_role(date, staff, 1, r)
+                    alt = self._select_staff_for_role(date, staff, 1, r, state)
                     if alt:
                         s = alt[0]
-                        new = self._new_shift_for_role(date, s, r)
-                        shifts.append(new)
-                        s.weekly_hours += self._hours(new.start_time, new.end_time)
+                        new = self._new_shift_for_role(date, s, r, state)
+                        state.add(new)
                         changes.append({
                             "type":"ADDED","date":date,
                             "staff_id":s.staff_id,"staff_name":s.name,
@@ -565,73 +2813,100 @@ class ScheduleEngine:
                             "reason":"Replacement for unavailable staff (closest role)"
                         })
                         break
-        return shifts, changes
+        return removed
 
     # --- Output Builders
-    def _flat(self, shifts, staff):
-        out = []
-        for sh in sorted(shifts, key=lambda x:(x.date, x.start_time, x.staff_id)):
-            s = next((st for st in staff if st.staff_id == sh.staff_id), None)
+    def _aggregate(self, shifts, staff: StaffRegistry, preds, business_type):
+        """
+        Single pass over shifts: each shift is looked up and costed once, filling
+        the flat list, payroll and total cost together; calendar days are then
+        cut from the (date-sorted) flat list.
+        """
+        pay: Dict[str, float] = {}
+        flat, total_cost = self._shift_rows(shifts, staff, pay)
+
+        by_date: Dict[str, List[Dict[str, Any]]] = {}
+        for f in flat:
+            by_date.setdefault(f["date"], []).append(f)
+        dates = sorted(set(preds) | {sh.date for sh in shifts})
+        days = [self._day_record(d, by_date.get(d, []), preds.get(d, 0), business_type) for d in dates]
+        calendar = {"start_date": dates[0], "end_date": dates[-1], "days": days} if dates else {"days": []}
+        return {
+            "calendar": calendar,
+            "flat_shifts": flat,
+            "payroll": {k: round(v, 2) for k, v in pay.items()},
+            "payroll_breakdown": PayrollLedger.from_rows(staff, flat).breakdown(),
+            "total_cost": total_cost,
+        }
+
+    @staticmethod
+    def _shift_rows(shifts, staff: StaffRegistry, pay: Dict[str, float]):
+        """Costed output rows sorted by (date, start, staff) and their total; payroll by name accumulates into pay."""
+        total_cost = 0.0
+        rows = []
+        for sh in shifts:
+            s = staff.get(sh.staff_id)
             if not s: continue
-            out.append({
+            hrs = sh.hours
+            cost = round(hrs * s.hourly_rate, 2)
+            total_cost += cost
+            pay.setdefault(s.name, 0)
+            pay[s.name] += cost
+            rows.append(((sh.date, sh.start_time, sh.staff_id), {
                 "shift_id": sh.shift_id, "date": sh.date,
                 "start_time": sh.start_time, "end_time": sh.end_time,
                 "role": sh.role, "is_owner_created": sh.is_owner_created,
                 "is_optimized": sh.is_optimized,
                 "staff_id": s.staff_id, "staff_name": s.name,
                 "hourly_rate": s.hourly_rate,
-                "hours": self._hours(sh.start_time, sh.end_time),
-                "cost": self._cost(sh, staff)
-            })
-        return out
+                "hours": hrs,
+                "cost": cost
+            }))
+        rows.sort(key=lambda r: r[0])
+        return [r for _, r in rows], total_cost
 
-    def _calendar(self, shifts, staff, preds, business_type):
-        if not preds and not shifts:
-            return {"days":[]}
-        dates = sorted(set(list(preds.keys()) + [s.date for s in shifts]))
-        group = self._group_by_date(shifts)
-        days = []
-        for d in dates:
-            dw = datetime.strptime(d, "%Y-%m-%d").strftime("%a")
-            flat = [x for x in self._flat(group.get(d, []), staff)]
-            pred = preds.get(d, 0)
-            status = "ok"
-            if pred and len(flat) < pred: status = "understaffed"
-            elif pred and len(flat) > pred: status = "overstaffed"
-            # role counts
-            role_counts: Dict[str,int] = {}
-            for f in flat:
-                role_counts[f["role"]] = role_counts.get(f["role"],0)+1
-            days.append({
-                "date": d, "day_name": dw, "predicted_required": pred,
-                "actual_count": len(flat), "status": status,
-                "business_type": business_type,
-                "totals": {
-                    "shifts": len(flat),
-                    "hours": round(sum(x["hours"] for x in flat), 2),
-                    "cost": round(sum(x["cost"] for x in flat), 2)
-                },
-                "roles": role_counts,
-                "shifts": flat
-            })
-        return {"start_date": dates[0], "end_date": dates[-1], "days": days}
-
-    def _payroll(self, shifts, staff):
-        pay = {}
-        for sh in shifts:
-            s = next((x for x in staff if x.staff_id == sh.staff_id), None)
-            if s:
-                pay.setdefault(s.name, 0)
-                pay[s.name] += self._cost(sh, staff)
-        return {k: round(v, 2) for k, v in pay.items()}
+    @staticmethod
+    def _day_record(d: str, day_flat: List[Dict[str, Any]], pred: int, business_type):
+        status = "ok"
+        if pred and len(day_flat) < pred: status = "understaffed"
+        elif pred and len(day_flat) > pred: status = "overstaffed"
+        # role counts
+        role_counts: Dict[str,int] = {}
+        for f in day_flat:
+            role_counts[f["role"]] = role_counts.get(f["role"],0)+1
+        return {
+            "date": d, "day_name": datetime.strptime(d, "%Y-%m-%d").strftime("%a"),
+            "predicted_required": pred,
+            "actual_count": len(day_flat), "status": status,
+            "business_type": business_type,
+            "totals": {
+                "shifts": len(day_flat),
+                "hours": round(sum(x["hours"] for x in day_flat), 2),
+                "cost": round(sum(x["cost"] for x in day_flat), 2)
+            },
+            "roles": role_counts,
+            "shifts": day_flat
+        }
 
-    def _summary(self, orig, opt, staff, preds):
+    def _build_output(self, staff: StaffRegistry, orig, opt, preds, changes, business_type):
+        agg = self._aggregate(opt, staff, preds, business_type)
+        return {
+            "calendar": agg["calendar"],
+            "flat_shifts": agg["flat_shifts"],
+            "changes": changes,
+            "predictions": preds,
+            "summary": self._summary_block(staff, orig, len(opt), agg["total_cost"], preds),
+            "payroll": agg["payroll"],
+            "payroll_breakdown": agg["payroll_breakdown"],
+            "metadata": self._metadata_block(staff, len(opt), business_type)
+        }
+
+    def _summary_block(self, staff: StaffRegistry, orig, n_after: int, nc: float, preds):
         oc = sum(self._cost(s, staff) for s in orig)
-        nc = sum(self._cost(s, staff) for s in opt)
         return {
             "total_shifts_before": len(orig),
-            "total_shifts_after": len(opt),
-            "shifts_change": len(opt) - len(orig),
+            "total_shifts_after": n_after,
+            "shifts_change": n_after - len(orig),
             "total_cost_before": round(oc, 2),
             "total_cost_after": round(nc, 2),
             "cost_savings": round(oc - nc, 2),
@@ -640,20 +2915,13 @@ class ScheduleEngine:
                 f"{min(preds.values())}-{max(preds.values())}" if preds else "N/A")
         }
 
-    def _build_output(self, staff, orig, opt, preds, changes, business_type):
+    @staticmethod
+    def _metadata_block(staff: StaffRegistry, n_after: int, business_type):
         return {
-            "calendar": self._calendar(opt, staff, preds, business_type),
-            "flat_shifts": self._flat(opt, staff),
-            "changes": changes,
-            "predictions": preds,
-            "summary": self._summary(orig, opt, staff, preds),
-            "payroll": self._payroll(opt, staff),
-            "metadata": {
-                "generated_at": datetime.now().isoformat(),
-                "total_staff": len(staff),
-                "total_shifts": len(opt),
-                "business_type": business_type or "general"
-            }
+            "generated_at": datetime.now().isoformat(),
+            "total_staff": len(staff),
+            "total_shifts": n_after,
+            "business_type": business_type or "general"
         }
 
     # --- LLM-style post-processing (no external calls here)
@@ -674,44 +2942,91 @@ class ScheduleEngine:
         return result
 
     def _heuristic_suggestions(self, result: Dict[str, Any], business_type: Optional[str]) -> List[str]:
-        suggestions = []
         cal = result.get("calendar", {})
         days = cal.get("days", [])
         role_keep_pri = self._removal_priority_for_bt(business_type)
         frontline = self._frontline_roles_for_bt(business_type)
 
-        for day in days:
-            pred = day.get("predicted_required", 0)
-            actual = day.get("actual_count", 0)
-            roles = day.get("roles", {})
-            date = day.get("date")
-            if actual < pred:
-                # find a frontline role with lowest presence
-                deficit = pred - actual
-                try_role = min(frontline, key=lambda r: roles.get(r, 0)) if frontline else "general"
-                suggestions.append(
-                    f"{date}: Understaffed by {deficit}. Prefer adding role '{try_role}' based on business '{business_type or 'general'}'."
-                )
-            elif actual > pred:
-                # find removable role by priority
-                removable = sorted(roles.items(), key=lambda kv: role_keep_pri.get(kv[0], 999), reverse=True)
-                if removable:
-                    r, c = removable[0]
-                    suggestions.append(
-                        f"{date}: Overstaffed by {actual - pred}. Consider trimming role '{r}' first."
-                    )
+        suggestions = [msg for day in days
+                       if (msg := self._day_suggestion(day, frontline, role_keep_pri, business_type))]
         if not suggestions:
-            suggestions.append("Schedule aligns with business-type role mix and predicted demand.")
+            suggestions.append(NO_SUGGESTIONS)
         return suggestions
 
+    @staticmethod
+    def _day_suggestion(day: Dict[str, Any], frontline: List[str], role_keep_pri: Dict[str, int],
+                        business_type: Optional[str]) -> Optional[str]:
+        pred = day.get("predicted_required", 0)
+        actual = day.get("actual_count", 0)
+        roles = day.get("roles", {})
+        date = day.get("date")
+        if actual < pred:
+            # find a frontline role with lowest presence
+            deficit = pred - actual
+            try_role = min(frontline, key=lambda r: roles.get(r, 0)) if frontline else "general"
+            return f"{date}: Understaffed by {deficit}. Prefer adding role '{try_role}' based on business '{business_type or 'general'}'."
+        elif actual > pred:
+            # find removable role by priority
+            removable = sorted(roles.items(), key=lambda kv: role_keep_pri.get(kv[0], 999), reverse=True)
+            if removable:
+                r, c = removable[0]
+                return f"{date}: Overstaffed by {actual - pred}. Consider trimming role '{r}' first."
+        return None
+
 # ---------------------------------
 # Flask Routes
 # ---------------------------------
 engine = ScheduleEngine()
+result_cache = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", "128")),
+    disk_path=os.getenv("RESULT_CACHE_PATH") or None,
+    max_disk_entries=int(os.getenv("RESULT_CACHE_DISK_SIZE", "1024")),
+)
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status":"ok","message":"Schedule optimizer is running"})
+    return jsonify({"status":"ok","message":"Schedule optimizer is running",
+                    "model": engine.model_registry.info(),
+                    "prediction_cache": engine.prediction_cache.stats(),
+                    "result_cache": result_cache.stats()})
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Per-stage totals since start (traced calls only; see SCHEDULE_TIMINGS)."""
+    return jsonify({"timings_enabled": TIMINGS_ENABLED, "stages": METRICS.snapshot()})
+
+def _timings_requested(data: dict) -> bool:
+    """metadata.timings is opt-in: body "timings": true or ?timings=1."""
+    return bool(data.get("timings")) or request.args.get("timings", "").lower() in ("1", "true", "yes")
+
+def _wants_ndjson() -> bool:
+    """Accept: application/x-ndjson → stream /schedule one calendar day per line."""
+    return request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson"
+
+def _ndjson(records: Iterator[Dict[str, Any]], route: str) -> Iterator[str]:
+    # Headers are already sent once streaming starts, so failures become a final error record
+    try:
+        for rec in records:
+            yield json.dumps(rec, default=str) + "\n"
+    except Exception as e:
+        logger.exception(f"Error in {route} stream")
+        yield json.dumps({"type": "error", "success": False, "error": str(e)}) + "\n"
+
+def _time_bounded(data: dict) -> bool:
+    """Local search and the optimal solver stop on wall-clock limits, so their output can differ run to run."""
+    return bool(data.get("time_budget_ms")) or data.get("solver") == "optimal"
+
+def _result_key(data: dict) -> str:
+    """
+    Content hash of everything a /schedule result depends on: the payload's
+    inputs and optimize options, the serving model version and the loaded
+    business-type rules. Output is deterministic for these unless the run is
+    _time_bounded(), so the hash doubles as the response ETag.
+    """
+    engine.model_registry.get()  # (re)load so a new model version means a new key
+    return ResultCache.key(engine.model_registry.version, engine.business_rules.digest,
+                           *(data.get(k) for k in ("staff", "schedule", "feature_lookup", "business_type")),
+                           {k: data[k] for k in OPTIMIZE_OPTIONS if k in data})
 
 @app.route("/schedule", methods=["POST"])
 def schedule():
@@ -723,10 +3038,54 @@ def schedule():
         sched  = data.get("schedule",[])
         feats  = data.get("feature_lookup",{})
         business_type = data.get("business_type")  # NEW
+        solver = data.get("solver", "greedy")
         if not staff:
             return jsonify({"success":False,"error":"staff is required"}),400
-        result = engine.optimize(staff,sched,feats,business_type)
-        return jsonify({"success":True,**result})
+        if solver not in SOLVERS:
+            return jsonify({"success":False,"error":f"solver must be one of {', '.join(SOLVERS)}"}),400
+        horizon = data.get("horizon", "single")
+        if horizon not in HORIZONS:
+            return jsonify({"success":False,"error":f"horizon must be one of {', '.join(HORIZONS)}"}),400
+        if _wants_ndjson():
+            records = engine.optimize_stream(staff,sched,feats,business_type,
+                                             solver=solver, solver_options=data.get("solver_options"),
+                                             time_budget_ms=data.get("time_budget_ms"),
+                                             search_options=data.get("search_options"),
+                                             slot_minutes=data.get("slot_minutes"),
+                                             business_hours=data.get("business_hours"),
+                                             horizon=horizon, max_workers=data.get("max_workers"),
+                                             carry_in_hours=data.get("carry_in_hours"))
+            return Response(stream_with_context(_ndjson(records, "/schedule")), mimetype="application/x-ndjson")
+        # Identical payloads are answered from result_cache (or 304 against If-None-Match);
+        # per-run timings, time-bounded runs and "Cache-Control: no-cache" always run the pipeline
+        timings = _timings_requested(data)
+        key = None if timings or _time_bounded(data) else _result_key(data)
+        if key is not None:
+            if request.if_none_match.contains_weak(key):
+                resp = Response(status=304)
+                resp.set_etag(key)
+                return resp
+            body = None if request.cache_control.no_cache else result_cache.get(key)
+            if body is not None:
+                resp = Response(body, mimetype="application/json")
+                resp.set_etag(key)
+                resp.headers["X-Cache"] = "HIT"
+                return resp
+        result = engine.optimize(staff,sched,feats,business_type,
+                                 solver=solver, solver_options=data.get("solver_options"),
+                                 time_budget_ms=data.get("time_budget_ms"),
+                                 search_options=data.get("search_options"),
+                                 slot_minutes=data.get("slot_minutes"),
+                                 business_hours=data.get("business_hours"),
+                                 timings=timings,
+                                 horizon=horizon, max_workers=data.get("max_workers"),
+                                 carry_in_hours=data.get("carry_in_hours"))
+        resp = jsonify({"success":True,**result})
+        if key is not None:
+            result_cache.put(key, resp.get_data())
+            resp.set_etag(key)
+            resp.headers["X-Cache"] = "MISS"
+        return resp
     except Exception as e:
         logger.exception("Error in /schedule")
         return jsonify({"success":False,"error":str(e)}),500
@@ -744,26 +3103,86 @@ def update():
         business_type = data.get("business_type")  # NEW
         if not staff or not upd:
             return jsonify({"success":False,"error":"staff and update are required"}),400
-        result = engine.update_schedule(staff,sched,feats,upd,business_type)
+        # incremental=true → re-plan only the disrupted date and answer with a delta patch;
+        # pass the previous response's "predictions" to skip the model entirely
+        result = engine.update_schedule(staff,sched,feats,upd,business_type,
+                                        incremental=bool(data.get("incremental") or upd.get("incremental")),
+                                        predictions=data.get("predictions"),
+                                        timings=_timings_requested(data))
         return jsonify({"success":True,**result})
     except Exception as e:
         logger.exception("Error in /update")
         return jsonify({"success":False,"error":str(e)}),500
 
+@app.route("/schedule/batch", methods=["POST"])
+def schedule_batch():
+    """
+    Optimize many businesses in one call. Body: {"businesses": [payload, ...],
+    "deadline_s": optional overall deadline, "max_workers": optional}. Each payload
+    is what optimize_schedule_from_data() takes plus "business_id". Results stream
+    back as NDJSON, one line per business in completion order.
+    """
+    data = request.get_json(force=True, silent=True)
+    if not data:
+        return jsonify({"success":False,"error":"Invalid JSON body"}),400
+    items = data.get("businesses")
+    if not isinstance(items, list) or not items:
+        return jsonify({"success":False,"error":"businesses must be a non-empty list"}),400
+
+    def generate():
+        for res in optimize_batch(items, max_workers=data.get("max_workers"), deadline_s=data.get("deadline_s")):
+            yield json.dumps(res, default=str) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/schedule/scenarios", methods=["POST"])
+def schedule_scenarios():
+    """
+    What-if comparison. Body: the /schedule payload plus "scenarios": [override, ...]
+    and optional "max_workers"; see ScheduleEngine.compare_scenarios for override keys.
+    """
+    try:
+        data = request.get_json(force=True, silent=True)
+        if not data:
+            return jsonify({"success":False,"error":"Invalid JSON body"}),400
+        staff = data.get("staff",[])
+        scenarios = data.get("scenarios")
+        if not staff:
+            return jsonify({"success":False,"error":"staff is required"}),400
+        if not isinstance(scenarios, list) or not scenarios:
+            return jsonify({"success":False,"error":"scenarios must be a non-empty list"}),400
+        for spec in [data, *scenarios]:
+            if not isinstance(spec, dict):
+                return jsonify({"success":False,"error":"each scenario must be an object"}),400
+            if spec.get("solver", "greedy") not in SOLVERS:
+                return jsonify({"success":False,"error":f"solver must be one of {', '.join(SOLVERS)}"}),400
+            if spec.get("horizon", "single") not in HORIZONS:
+                return jsonify({"success":False,"error":f"horizon must be one of {', '.join(HORIZONS)}"}),400
+        result = engine.compare_scenarios(staff, data.get("schedule",[]), data.get("feature_lookup",{}),
+                                          scenarios, data.get("business_type"),
+                                          max_workers=data.get("max_workers"),
+                                          **{k: data[k] for k in OPTIMIZE_OPTIONS if k in data})
+        return jsonify({"success":True,**result})
+    except Exception as e:
+        logger.exception("Error in /schedule/scenarios")
+        return jsonify({"success":False,"error":str(e)}),500
+
 def optimize_schedule_from_data(data: dict, business_id: str) -> dict:
     """Optimize schedule from extracted data with business type awareness"""
     try:
         # Parse staff data
         staff_members = []
         for staff_data in data.get('staff', []):
+            # data_extractor emits a "roles" list; older payloads carry a single "role"
+            roles = staff_data.get('roles') or staff_data.get('role') or ['general']
             staff_members.append(StaffMember(
                 staff_id=staff_data.get('staff_id', ''),
-                name=f"{staff_data.get('first_name', '')} {staff_data.get('last_name', '')}".strip(),
+                name=staff_data.get('name') or f"{staff_data.get('first_name', '')} {staff_data.get('last_name', '')}".strip(),
                 hourly_rate=float(staff_data.get('hourly_rate', 0)),
                 max_hours_per_week=int(staff_data.get('max_hours_per_week', 0)),
                 preferred_shifts=staff_data.get('preferred_shifts', []),
                 unavailable_days=staff_data.get('unavailable_days', []),
-                roles=[staff_data.get('role', 'general')] if staff_data.get('role') else ['general']
+                unavailable_dates=staff_data.get('unavailable_dates', []),
+                roles=[roles] if isinstance(roles, str) else list(roles)
             ))
         
         # Parse existing schedule
@@ -786,15 +3205,17 @@ def optimize_schedule_from_data(data: dict, business_id: str) -> dict:
         # Get business type
         business_type = data.get('business_type', 'general')
         
-        # Create schedule optimizer
-        optimizer = ScheduleEngine()
+        # Shared schedule optimizer (model loaded once per process)
+        optimizer = engine
         
         # Generate optimized schedule with business type awareness
         result = optimizer.optimize(
             staff_data=staff_members,
             schedule_data=existing_shifts,
             feature_lookup=feature_lookup,
-            business_type=business_type
+            business_type=business_type,
+            horizon=data.get('horizon', 'single'),
+            carry_in_hours=data.get('carry_in_hours')
         )
         
         return {
@@ -808,6 +3229,7 @@ def optimize_schedule_from_data(data: dict, business_id: str) -> dict:
             "changes": result.get('changes', []),
             "predictions": result.get('predictions', []),
             "payroll": result.get('payroll', {}),
+            "payroll_breakdown": result.get('payroll_breakdown', {}),
             "generated_at": datetime.now().isoformat()
         }
         
@@ -818,17 +3240,77 @@ def optimize_schedule_from_data(data: dict, business_id: str) -> dict:
             "business_id": business_id
         }
 
+def _plan_week_job(job: tuple):
+    """Process-pool worker for ScheduleEngine._apply_weekly: plan one ISO week."""
+    shifts, members, preds, business_type, solver, solver_options, carry_in = job
+    return engine._plan_week(shifts, StaffRegistry(members), preds, business_type,
+                             solver, solver_options, carry_in)
+
+def _scenario_job(job: tuple) -> dict:
+    """Process-pool worker for ScheduleEngine.compare_scenarios: one variant → its comparison row."""
+    return engine._run_scenario(*job)
+
+def _optimize_batch_item(item: dict) -> dict:
+    """Process-pool worker: one business payload → optimize_schedule_from_data() result."""
+    return optimize_schedule_from_data(item, str(item.get("business_id", "")))
+
+def optimize_batch(items: List[dict], max_workers: Optional[int] = None,
+                   deadline_s: Optional[float] = None) -> Iterator[dict]:
+    """
+    Fan business payloads out over a process pool sized to the machine's cores and
+    yield each result as soon as it completes. A failing or crashed item only
+    produces its own error record; items still pending at the deadline are
+    reported as timed out and cancelled.
+    """
+    if not items:
+        return
+    workers = max(1, min(int(max_workers or os.cpu_count() or 1), len(items)))
+    # Load before forking so workers share the model's pages instead of each loading a copy
+    engine.model_registry.get()
+    pool = ProcessPoolExecutor(max_workers=workers)
+    futures = {pool.submit(_optimize_batch_item, item): str(item.get("business_id", i))
+               for i, item in enumerate(items)}
+    pending = set(futures)
+    try:
+        for fut in as_completed(futures, timeout=deadline_s):
+            pending.discard(fut)
+            try:
+                yield fut.result()
+            except Exception as e:
+                logger.warning(f"Batch item {futures[fut]} failed: {e}")
+                yield {"success": False, "error": str(e), "business_id": futures[fut]}
+    except FuturesTimeout:
+        for fut in pending:
+            fut.cancel()
+            yield {"success": False, "error": f"Deadline of {deadline_s}s exceeded",
+                   "business_id": futures[fut]}
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
 def main():
     """Command line interface for schedule optimization"""
     import argparse
-    import json
     
     parser = argparse.ArgumentParser(description='Optimize schedule with business type awareness')
-    parser.add_argument('--input-file', required=True, help='JSON file with extracted data')
-    parser.add_argument('--business-id', required=True, help='Business ID')
+    parser.add_argument('--input-file', help='JSON file with extracted data')
+    parser.add_argument('--business-id', help='Business ID')
     parser.add_argument('--output-format', choices=['json', 'summary'], default='json', help='Output format')
+    parser.add_argument('--batch-file', help='JSON file with a list of business payloads (each with business_id); prints NDJSON')
+    parser.add_argument('--workers', type=int, help='Process pool size for --batch-file (default: CPU count)')
+    parser.add_argument('--deadline', type=float, help='Overall deadline in seconds for --batch-file')
     
     args = parser.parse_args()
+
+    if args.batch_file:
+        with open(args.batch_file, 'r') as f:
+            items = json.load(f)
+        if isinstance(items, dict):
+            items = items.get('businesses', [])
+        for res in optimize_batch(items, max_workers=args.workers, deadline_s=args.deadline):
+            print(json.dumps(res, default=str), flush=True)
+        return
+    if not args.input_file or not args.business_id:
+        parser.error('--input-file and --business-id are required unless --batch-file is given')
     
     try:
         # Load input data
@@ -859,7 +3341,7 @@ def main():
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) > 1 and sys.argv[1] in ['--input-file', '--business-id', '--output-format']:
+    if len(sys.argv) > 1 and sys.argv[1] in ['--input-file', '--business-id', '--output-format', '--batch-file']:
         # CLI mode
         main()
     else:
@@ -0,0 +1,123 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import index
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return index.ScheduleEngine()
+
+
+def _staff(n, **extra):
+    return [{"staff_id": f"S{i}", "name": f"Staff {i}", "hourly_rate": 10 + i, "max_hours_per_week": 40,
+             "preferred_shifts": ["morning"], "unavailable_days": [], **extra} for i in range(n)]
+
+
+def _shift(shift_id, staff_id, date, start="09:00", end="17:00", role="general", owner=True):
+    return {"shift_id": shift_id, "staff_id": staff_id, "date": date, "start_time": start, "end_time": end,
+            "role": role, "is_owner_created": owner, "is_optimized": not owner}
+
+
+def _key(sh):
+    return sh["staff_id"], sh["date"], sh["start_time"], sh["end_time"], sh["role"]
+
+
+def _patched(schedule, result):
+    """The submitted schedule with an incremental result's patch applied."""
+    removed = {sh["shift_id"] for sh in result["patch"]["removed"]}
+    return sorted([_key(sh) for sh in schedule if sh["shift_id"] not in removed]
+                  + [_key(sh) for sh in result["patch"]["added"]])
+
+
+def _assert_net(changes):
+    adds = {(c["date"], c["staff_id"], c["shift_time"], c["role"]) for c in changes if c["type"] == "ADDED"}
+    removes = {(c["date"], c["staff_id"], c["shift_time"], c["role"]) for c in changes if c["type"] == "REMOVED"}
+    assert not adds & removes
+
+
+@pytest.mark.parametrize("roles, features", [
+    # The disrupted date has no features: neither path re-plans it
+    (["general"] * 3, {"2025-01-07": {"total_staff_count": 5, "available_staff_count": 5}}),
+    # Predicted 2: the delivery replacement and a role-mix addition are trimmed again
+    (["delivery", "cashier", "cashier"], {"2025-01-06": {"total_staff_count": 5, "available_staff_count": 2}}),
+])
+def test_incremental_update_matches_full(engine, roles, features):
+    staff = _staff(5, roles=["cashier", "floor_exec", "delivery", "general"])
+    schedule = [_shift(f"o{i}", f"S{i}", "2025-01-06", role=role) for i, role in enumerate(roles)]
+    update = {"update_type": "staff_unavailable", "date": "2025-01-06", "staff_id": "S0"}
+
+    full = engine.update_schedule(staff, schedule, features, update)
+    inc = engine.update_schedule(staff, schedule, features, update, incremental=True,
+                                 predictions=full["predictions"])
+
+    # Other dates with features are re-planned by the full path only
+    dates = {sh["date"] for sh in schedule}
+    assert _patched(schedule, inc) == sorted(_key(sh) for sh in full["flat_shifts"] if sh["date"] in dates)
+    _assert_net(full["changes"])
+    _assert_net(inc["changes"])
+
+
+def test_cover_slide_respects_other_shifts(engine):
+    staff = engine._to_staff(_staff(2, roles=["general"]))
+    shifts = engine._to_shifts([
+        _shift("a", "S0", "2025-01-06", "14:00", "22:00", owner=False),
+        _shift("b", "S1", "2025-01-06", "14:00", "22:00", owner=False),
+        _shift("c", "S0", "2025-01-06", "12:00", "13:00"),
+    ])
+    feats = {"2025-01-06": {"hourly_demand": {h: 1 for h in range(8, 22)}}}
+
+    out, changes, _ = engine._cover_intraday(shifts, staff, {"2025-01-06": 2}, feats, None, 60)
+
+    # S0 cannot slide to 08:00-16:00 over their own 12:00-13:00 shift; S1 moves instead
+    assert [(c["type"], c["staff_id"], c["shift_time"]) for c in changes] == [("ADJUSTED", "S1", "08:00-16:00")]
+    for sid in ("S0", "S1"):
+        held = sorted((sh.start_min, sh.start_min + sh.minutes) for sh in out if sh.staff_id == sid)
+        assert all(end <= start for (_, end), (start, _) in zip(held, held[1:]))
+
+
+class _FakeQuery:
+    """Just enough of a supabase table query: filters are ignored, execute() returns the rows."""
+
+    def __init__(self, rows):
+        self.data = rows
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return self
+
+
+class _FakeSupabase:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def table(self, name):
+        return _FakeQuery(self.tables.get(name, []))
+
+
+def test_extracted_roles_reach_optimizer(monkeypatch):
+    os.environ.setdefault("SUPABASE_URL", "http://localhost")
+    os.environ.setdefault("SUPABASE_KEY", "test")
+    data_extractor = pytest.importorskip("data_extractor")
+    roles = [["cashier"], "floor_exec", ["picker", "qc"], ["delivery"], ["cashier", "floor_exec"], ["floor_exec"]]
+    monkeypatch.setattr(data_extractor, "supabase", _FakeSupabase({
+        "businesses": [{"business_type": "grocery", "shop_name": "Test"}],
+        "staff_members": [{"staff_id": f"S{i}", "first_name": f"Staff {i}", "role": role, "hourly_rate": 100,
+                           "max_hours_per_week": 48} for i, role in enumerate(roles)],
+    }))
+
+    data = data_extractor.extract_data_for_schedule("b1", days_back=6)
+    for feats in data["feature_lookup"].values():
+        feats.update(total_staff_count=len(roles), available_staff_count=len(roles))
+    result = index.optimize_schedule_from_data(data, "b1")
+
+    assert result["success"], result.get("error")
+    can_work = {s["staff_id"]: set(s["roles"]) for s in data["staff"]}
+    assigned = {(sh["staff_id"], sh["role"]) for sh in result["optimized_schedule"]}
+    assert assigned and all(role in can_work[sid] for sid, role in assigned)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Staffing Model Training Pipeline
+--------------------------------
+Historical shifts + feature_lookup, as pulled by
+data_extractor.extract_data_for_schedule(), → a RandomForestRegressor over
+index.MODEL_FEATURES, written as a versioned model plus a "<model>.meta.json"
+sidecar (ModelRegistry serves the sidecar's "version").
+
+One training row per store-date that has both features and shifts; the target
+is how many distinct staff worked it, with ScheduleEngine._predict()'s weekend
+and festive multipliers divided out because _predict() applies them again.
+Dates nobody worked are treated as missing history, not as zero demand.
+
+    python train_model.py --input extract_a.json extract_b.json          # full fit + CV search
+    python train_model.py --business-id B1 B2 --days-back 365 --city Mumbai
+    python train_model.py --input last_week.json --incremental --weeks 1  # add trees for new weeks
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import index
+from index import FESTIVE_FLAGS, FESTIVE_MULTIPLIER, MODEL_FEATURES, WEEKEND_MULTIPLIER
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = os.path.join(index.MODEL_DIR, index.DEFAULT_MODEL_PATH)
+# Every trained model is also kept here as "<stem>-<version>.pkl" (+ .meta.json)
+VERSIONS_DIRNAME = "model_versions"
+
+# Searched by RandomizedSearchCV for full fits
+PARAM_DISTRIBUTIONS = {
+    "n_estimators": [100, 200, 300, 500],
+    "max_depth": [None, 6, 8, 12, 16],
+    "min_samples_leaf": [1, 2, 4, 8],
+    "max_features": [1.0, 0.5, "sqrt"],
+}
+# Used as-is when there are too few dates to cross-validate
+DEFAULT_PARAMS = {"n_estimators": 200, "max_depth": None, "min_samples_leaf": 2, "max_features": 1.0}
+
+# ---------------------------------
+# Training data
+# ---------------------------------
+def load_payloads(inputs: Optional[List[str]] = None, business_ids: Optional[List[str]] = None,
+                  days_back: int = 365) -> List[Dict[str, Any]]:
+    """
+    Extracted payloads from JSON files (one payload, a list of them, or
+    {"businesses": [...]}) and/or fetched live per business_id. Payloads the
+    extractor answered with an "error" are skipped.
+    """
+    payloads: List[Dict[str, Any]] = []
+    for path in inputs or []:
+        with open(path, "r") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get("businesses", [data])
+        payloads.extend(data)
+    if business_ids:
+        # Imported here: the extractor connects to Supabase on import
+        from data_extractor import extract_data_for_schedule
+        for bid in business_ids:
+            payloads.append(extract_data_for_schedule(bid, days_back))
+    ok = []
+    for p in payloads:
+        if "error" in p:
+            logger.warning(f"Skipping payload: {p['error']}")
+        else:
+            ok.append(p)
+    return ok
+
+def build_training_frame(payloads: List[Dict[str, Any]], city: Optional[str] = None) -> pd.DataFrame:
+    """
+    Date-sorted rows of date, week (ISO), MODEL_FEATURES, staff_count and target.
+    city keeps only rows whose city_<city> one-hot column is set.
+    """
+    rows = []
+    for p in payloads:
+        heads: Dict[str, set] = {}
+        for sh in p.get("schedule", []):
+            if sh.get("date") and sh.get("staff_id"):
+                heads.setdefault(sh["date"], set()).add(sh["staff_id"])
+        feats = index.engine._normalize_features(p.get("feature_lookup", {}), [])
+        for d in sorted(heads.keys() & feats.keys()):
+            rows.append({**feats[d], "date": d, "staff_count": len(heads[d])})
+    frame = pd.DataFrame.from_records(rows, columns=["date", *MODEL_FEATURES, "staff_count"])
+    for col in MODEL_FEATURES:
+        frame[col] = pd.to_numeric(frame[col], errors="coerce").fillna(0)
+    if city:
+        col = f"city_{city}"
+        if col not in MODEL_FEATURES:
+            raise ValueError(f"Unknown city '{city}', expected one of "
+                             f"{', '.join(c[5:] for c in MODEL_FEATURES if c.startswith('city_'))}")
+        frame = frame[frame[col] == 1]
+    frame = frame.sort_values("date", kind="stable").reset_index(drop=True)
+
+    days = pd.to_datetime(frame["date"], format="%Y-%m-%d")
+    frame["week"] = [index._iso_week(d) for d in frame["date"]]
+    # Invert _predict()'s multipliers, in reverse order
+    target = frame["staff_count"].astype(float).to_numpy()
+    festive = np.logical_or.reduce([frame[f].astype(bool).to_numpy() for f in FESTIVE_FLAGS])
+    target = np.where(festive, target / FESTIVE_MULTIPLIER, target)
+    target = np.where(days.dt.dayofweek.to_numpy() >= 5, target / WEEKEND_MULTIPLIER, target)
+    frame["target"] = target
+    return frame
+
+def data_hash(frame: pd.DataFrame) -> str:
+    return hashlib.sha1(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes()).hexdigest()
+
+# ---------------------------------
+# Fitting
+# ---------------------------------
+def search_params(X: pd.DataFrame, y: np.ndarray, n_iter: int = 20, n_splits: int = 5,
+                  jobs: int = -1, seed: int = 42) -> Tuple[Dict[str, Any], Optional[float]]:
+    """
+    RandomizedSearchCV over PARAM_DISTRIBUTIONS scored by MAE on TimeSeriesSplit
+    folds (rows are date-sorted, so every fold validates on later dates than it
+    trained on). Candidates fit in parallel across jobs with single-threaded
+    forests, which keeps the cores busy without oversubscribing them.
+    Returns (best params, best CV MAE), or the defaults and None with too few rows.
+    """
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.model_selection import RandomizedSearchCV, TimeSeriesSplit
+
+    n_splits = min(n_splits, len(X) // 2)
+    if n_splits < 2:
+        return dict(DEFAULT_PARAMS), None
+    search = RandomizedSearchCV(
+        RandomForestRegressor(random_state=seed, n_jobs=1),
+        PARAM_DISTRIBUTIONS, n_iter=n_iter, cv=TimeSeriesSplit(n_splits=n_splits),
+        scoring="neg_mean_absolute_error", n_jobs=jobs, random_state=seed, refit=False,
+    )
+    search.fit(X, y)
+    return dict(search.best_params_), round(float(-search.best_score_), 4)
+
+def fit_full(X: pd.DataFrame, y: np.ndarray, params: Dict[str, Any], jobs: int = -1, seed: int = 42):
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(**params, random_state=seed, n_jobs=jobs).fit(X, y)
+
+def fit_incremental(model, X: pd.DataFrame, y: np.ndarray, add_trees: int = 50,
+                    max_trees: Optional[int] = None, jobs: int = -1):
+    """
+    warm_start: keep the existing trees and grow add_trees new ones on (X, y)
+    only, typically the newest weeks. With max_trees the oldest trees beyond it
+    are dropped, so the forest slides forward instead of growing every night.
+    """
+    names = list(getattr(model, "feature_names_in_", []))
+    if names != list(MODEL_FEATURES):
+        raise ValueError("Model was not fitted on MODEL_FEATURES; run a full retrain first")
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + add_trees, n_jobs=jobs)
+    model.fit(X, y)
+    if max_trees and len(model.estimators_) > max_trees:
+        model.estimators_ = model.estimators_[-max_trees:]
+        model.n_estimators = max_trees
+    model.set_params(warm_start=False)
+    return model
+
+# ---------------------------------
+# Publishing
+# ---------------------------------
+def read_meta(model_path: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.splitext(model_path)[0] + ".meta.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_atomic(path: str, write):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+def publish(model, meta: Dict[str, Any], output: str, keep: int = 5) -> str:
+    """
+    Archive the model as <stem>-<version>.pkl (+ sidecar) under model_versions/,
+    keeping the newest keep, then swap it in at output. The live sidecar records
+    the (mtime, size) of the model file it describes, which os.replace keeps, and
+    ModelRegistry ignores a sidecar whose stamp doesn't match the file it loads,
+    so a reload between the two writes never pairs one model with the other's
+    version. The sidecar goes first because the registry only reloads once the
+    model file itself changes. Returns the archived model path.
+    """
+    out_dir = os.path.dirname(os.path.abspath(output))
+    stem = os.path.splitext(os.path.basename(output))[0]
+    versions = os.path.join(out_dir, VERSIONS_DIRNAME)
+    os.makedirs(versions, exist_ok=True)
+    archived = os.path.join(versions, f"{stem}-{meta['version']}.pkl")
+    joblib.dump(model, archived)
+    meta_text = json.dumps(meta, indent=2, default=str)
+    with open(os.path.splitext(archived)[0] + ".meta.json", "w") as f:
+        f.write(meta_text)
+
+    staged = f"{output}.{os.getpid()}.tmp"
+    shutil.copyfile(archived, staged)
+    st = os.stat(staged)
+    live_text = json.dumps({**meta, "model_stamp": [st.st_mtime, st.st_size]}, indent=2, default=str)
+
+    def write_meta(tmp):
+        with open(tmp, "w") as f:
+            f.write(live_text)
+    _write_atomic(os.path.join(out_dir, f"{stem}.meta.json"), write_meta)
+    os.replace(staged, output)
+
+    # Version strings start with a UTC timestamp, so name order is age order
+    old = sorted(glob.glob(os.path.join(versions, f"{stem}-*.pkl")))[:-keep] if keep > 0 else []
+    for path in old:
+        for p in (path, os.path.splitext(path)[0] + ".meta.json"):
+            if os.path.exists(p):
+                os.remove(p)
+    return archived
+
+# ---------------------------------
+# Pipeline
+# ---------------------------------
+def train(frame: pd.DataFrame, output: str = DEFAULT_OUTPUT, incremental: bool = False, weeks: int = 2,
+          add_trees: int = 50, max_trees: Optional[int] = None, n_iter: int = 20, cv_splits: int = 5,
+          jobs: int = -1, seed: int = 42, city: Optional[str] = None, keep: int = 5,
+          compile_forest: bool = False) -> Dict[str, Any]:
+    """Fit (full or incremental), publish to output and return the written metadata."""
+    if frame.empty:
+        raise ValueError("No training rows: need dates that have both feature_lookup entries and shifts")
+    t0 = time.perf_counter()
+    parent = read_meta(output) if incremental else {}
+    if incremental:
+        newest = sorted(frame["week"].unique())[-weeks:]
+        frame = frame[frame["week"].isin(newest)]
+    X, y = frame[list(MODEL_FEATURES)], frame["target"].to_numpy()
+    if incremental:
+        model = fit_incremental(joblib.load(output), X, y, add_trees, max_trees, jobs)
+        params, cv_mae = {k: model.get_params()[k] for k in PARAM_DISTRIBUTIONS}, None
+    else:
+        params, cv_mae = search_params(X, y, n_iter, cv_splits, jobs, seed)
+        model = fit_full(X, y, params, jobs, seed)
+
+    now = datetime.now(timezone.utc)
+    meta = {
+        "version": f"{now:%Y%m%dT%H%M%SZ}-{data_hash(frame)[:8]}",
+        "trained_at": now.isoformat(),
+        "mode": "incremental" if incremental else "full",
+        "parent_version": parent.get("version"),
+        "city": city,
+        "rows": len(frame),
+        "dates": {"first": frame["date"].iloc[0], "last": frame["date"].iloc[-1]},
+        "weeks": {"first": frame["week"].min(), "last": frame["week"].max(), "count": int(frame["week"].nunique())},
+        "features": list(MODEL_FEATURES),
+        "target": "distinct staff per date / weekend and festive multipliers",
+        "params": params,
+        "n_estimators": len(model.estimators_),
+        "cv_mae": cv_mae,
+        "train_mae": round(float(np.abs(model.predict(X) - y).mean()), 4),
+        "fit_seconds": round(time.perf_counter() - t0, 2),
+    }
+    meta["archived_as"] = publish(model, meta, output, keep)
+    if compile_forest:
+        # Build the memory-mapped .forest.npz now rather than on the first server load
+        meta["compiled"] = isinstance(index.ModelRegistry(os.path.abspath(output)).get(), index.CompiledForest)
+    return meta
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the staffing model from historical shifts")
+    parser.add_argument("--input", nargs="+", help="Extracted payload JSON files (data_extractor.py --json)")
+    parser.add_argument("--business-id", nargs="+", help="Fetch history live for these businesses")
+    parser.add_argument("--days-back", type=int, default=365, help="History window for --business-id")
+    parser.add_argument("--city", help="Train only on rows of this city (e.g. Mumbai)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Live model path to publish to")
+    parser.add_argument("--incremental", action="store_true", help="Add trees for the newest weeks to --output")
+    parser.add_argument("--weeks", type=int, default=2, help="Newest ISO weeks used by --incremental")
+    parser.add_argument("--add-trees", type=int, default=50, help="Trees grown by --incremental")
+    parser.add_argument("--max-trees", type=int, help="Drop the oldest trees beyond this after --incremental")
+    parser.add_argument("--n-iter", type=int, default=20, help="Hyperparameter candidates for a full fit")
+    parser.add_argument("--cv-splits", type=int, default=5, help="TimeSeriesSplit folds for a full fit")
+    parser.add_argument("--jobs", type=int, default=-1, help="Parallel fitting jobs (-1 = all cores)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--keep", type=int, default=5, help="Archived versions to keep")
+    parser.add_argument("--compile", action="store_true", help="Also write the compiled .forest.npz cache")
+    args = parser.parse_args()
+    if not args.input and not args.business_id:
+        parser.error("--input or --business-id is required")
+
+    try:
+        frame = build_training_frame(load_payloads(args.input, args.business_id, args.days_back), args.city)
+        meta = train(frame, args.output, incremental=args.incremental, weeks=args.weeks,
+                     add_trees=args.add_trees, max_trees=args.max_trees, n_iter=args.n_iter,
+                     cv_splits=args.cv_splits, jobs=args.jobs, seed=args.seed, city=args.city,
+                     keep=args.keep, compile_forest=args.compile)
+    except ValueError as e:
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(1)
+    print(json.dumps({"success": True, **meta}, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()